@@ -0,0 +1,152 @@
+#
+# Copyright (C) 2015 BMW Car IT GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import asyncio
+import os
+import signal
+import sys
+import time
+import warnings
+from asyncio.subprocess import PIPE
+
+from pyrate.capture import CHUNK_SIZE
+from pyrate.model.teststep import Execution, StepResult
+from pyrate.process import TreeMonitor, kill_process_tree
+from pyrate.util import elapsed
+
+
+def use_pidfd_watcher():
+    # Before python 3.12 asyncio waits for every child process with a thread
+    # of its own. A pidfd based watcher needs no thread at all.
+    if sys.version_info >= (3, 12) or not hasattr(asyncio,
+                                                  'PidfdChildWatcher'):
+        return
+    try:
+        os.close(os.pidfd_open(os.getpid()))
+    except (AttributeError, OSError):
+        return
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)
+        asyncio.set_child_watcher(asyncio.PidfdChildWatcher())
+
+
+class AsyncEngine:
+    # Runs test steps as asyncio subprocesses, so any number of steps can
+    # wait for their processes on a single thread. At most 'limit' processes
+    # run at the same time.
+    #
+    # The process is reaped by asyncio, so cpu time and memory usage are
+    # only recorded for steps whose process tree is monitored.
+
+    def __init__(self, limit):
+        self.limit = max(limit, 1)
+        self.semaphore = None
+
+    async def execute(self, step, variables, cancel=None):
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.limit)
+
+        execution = Execution(step, variables)
+        result = execution.cached()
+        if result is not None:
+            return result
+
+        async with self.semaphore:
+            result = await self.spawn(step, execution, cancel)
+        result = execution.validate(result)
+        if step.repeat is not None:
+            results = [result]
+            while results[-1].success and len(results) < step.repeat.count:
+                again = Execution(step, variables)
+                async with self.semaphore:
+                    run = await self.spawn(step, again, cancel)
+                results.append(again.validate(run))
+            result = execution.limit(results)
+        if cancel is not None and cancel.cancelled:
+            # killed because a fatal case failed, not by its own doing
+            result.success = False
+            result.failure = 'cancelled'
+        execution.remember(result)
+        return result
+
+    async def spawn(self, step, execution, cancel):
+        result = StepResult()
+
+        start = time.perf_counter()
+        process = await asyncio.create_subprocess_shell(
+            execution.command, stdout=PIPE, stderr=PIPE)
+        result.spawn = elapsed(start)
+
+        if cancel is not None:
+            cancel.register(process)
+
+        monitor = None
+        if step.monitored:
+            monitor = TreeMonitor(process.pid).start()
+
+        async def read(stream, sink):
+            while True:
+                data = await stream.read(CHUNK_SIZE)
+                if not data:
+                    sink.close()
+                    return
+                sink.feed(data)
+
+                if (execution.abort is not None and not result.aborted and
+                        execution.abort()):
+                    result.aborted = True
+                    kill_process_tree(process.pid)
+
+        async def complete():
+            await asyncio.gather(read(process.stdout,
+                                      execution.sinks['stdout']),
+                                 read(process.stderr,
+                                      execution.sinks['stderr']))
+            return await process.wait()
+
+        task = asyncio.ensure_future(complete())
+        if step.timeout > 0:
+            try:
+                await asyncio.wait_for(asyncio.shield(task),
+                                       step.timeout / 1000.0)
+            except asyncio.TimeoutError:
+                result.timed_out = True
+                await self.terminate(process, step.grace, task)
+
+        try:
+            result.exitcode = await task
+        finally:
+            if monitor is not None:
+                monitor.stop()
+        result.wall = elapsed(start)
+        if monitor is not None:
+            monitor.record(result)
+
+        if cancel is not None:
+            cancel.unregister(process)
+
+        return result
+
+    async def terminate(self, process, grace, task):
+        if grace > 0:
+            kill_process_tree(process.pid, signal.SIGTERM)
+            try:
+                await asyncio.wait_for(asyncio.shield(task), grace / 1000.0)
+                return
+            except asyncio.TimeoutError:
+                pass
+        kill_process_tree(process.pid, signal.SIGKILL)
@@ -0,0 +1,173 @@
+#
+# Copyright (C) 2015 BMW Car IT GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import codecs
+import mmap
+import os
+import selectors
+import tempfile
+
+from pyrate.process import kill_process_tree
+
+CHUNK_SIZE = 65536
+
+
+class BufferSink:
+    # Keeps the complete stream. Up to 'limit' bytes are kept in memory, a
+    # larger stream is spilled to a temporary file, which is mapped into
+    # memory for the validation.
+
+    limit = 16 * 1024 * 1024
+
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+        self.file = None
+        self.map = None
+
+    @property
+    def spilled(self):
+        return self.file is not None
+
+    def feed(self, data):
+        self.size += len(data)
+        if self.file is not None:
+            self.file.write(data)
+            return
+
+        self.chunks.append(data)
+        if self.size > self.limit:
+            self.file = tempfile.TemporaryFile(prefix='pyrate-')
+            for chunk in self.chunks:
+                self.file.write(chunk)
+            self.chunks = []
+
+    def close(self):
+        pass
+
+    def getvalue(self):
+        return b''.join(self.chunks)
+
+    def view(self):
+        # the spilled stream as read-only bytes-like object
+        if self.map is None:
+            self.file.flush()
+            self.map = mmap.mmap(self.file.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+        return self.map
+
+    def excerpt(self, size):
+        # the start and the end of a spilled stream as text
+        view = self.view()
+        if self.size <= size:
+            return view[:].decode('utf-8', 'replace')
+        half = size // 2
+        return "%s\n[... %d bytes omitted ...]\n%s" % (
+            view[:half].decode('utf-8', 'replace'), self.size - 2 * half,
+            view[self.size - half:].decode('utf-8', 'replace'))
+
+    def release(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class Tail:
+    # keeps the last 'size' characters of a stream
+
+    def __init__(self, size):
+        self.size = size
+        self.text = ''
+        self.dropped = 0
+
+    def feed(self, text):
+        text = self.text + text
+        if len(text) > self.size:
+            self.dropped += len(text) - self.size
+            text = text[len(text) - self.size:]
+        self.text = text
+
+    def getvalue(self):
+        if self.dropped:
+            return "[... %d characters omitted ...]\n%s" % (self.dropped,
+                                                           self.text)
+        return self.text
+
+
+class LineSink:
+    # Decodes a stream incrementally and hands it to the consumer in blocks
+    # of complete lines. A line longer than CHUNK_SIZE characters is handed
+    # over in pieces. Only a bounded tail of the stream is kept.
+
+    def __init__(self, consumer, tail_size):
+        self.consumer = consumer
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.partial = ''
+        self.tail = Tail(tail_size)
+
+    def feed(self, data):
+        self.push(self.decoder.decode(data))
+
+    def close(self):
+        self.push(self.decoder.decode(b'', final=True))
+        if self.partial and self.consumer is not None:
+            self.consumer(self.partial)
+        self.partial = ''
+
+    def push(self, text):
+        self.tail.feed(text)
+
+        text = self.partial + text
+        end = text.rfind('\n') + 1
+        if len(text) - end > CHUNK_SIZE:
+            end = len(text)
+        self.partial = text[end:]
+        if end and self.consumer is not None:
+            self.consumer(text[:end])
+
+    def getvalue(self):
+        return self.tail.getvalue()
+
+
+def capture(process, stdout, stderr, abort=None):
+    # Reads stdout and stderr of the process in chunks and passes them to
+    # the given sinks until both streams are closed. 'abort' is asked after
+    # each chunk and kills the process tree once it returns True.
+    # Returns whether the process was aborted, the process isn't waited for.
+    selector = selectors.DefaultSelector()
+    selector.register(process.stdout, selectors.EVENT_READ, stdout)
+    selector.register(process.stderr, selectors.EVENT_READ, stderr)
+
+    aborted = False
+    while selector.get_map():
+        for key, _ in selector.select():
+            data = os.read(key.fd, CHUNK_SIZE)
+            if not data:
+                selector.unregister(key.fileobj)
+                key.fileobj.close()
+                key.data.close()
+                continue
+            key.data.feed(data)
+
+        if abort is not None and not aborted and abort():
+            aborted = True
+            kill_process_tree(process.pid)
+
+    selector.close()
+    return aborted
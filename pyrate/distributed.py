@@ -0,0 +1,463 @@
+#
+# Copyright (C) 2015 BMW Car IT GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import json
+import os
+import socket
+import sys
+import threading
+import time
+import traceback
+
+import yaml
+
+from pyrate.fixtures import fixtures
+from pyrate.model import env
+from pyrate.model.fixture import Fixture
+from pyrate.model.matrix import Matrix
+from pyrate.model.spec import Loader, parse_spec
+from pyrate.model.testcase import TestCase
+from pyrate.model.teststep import StepResult, TestStep
+from pyrate.output.buffer import ThreadOutput
+from pyrate.output.reporter import Reporter, reporters
+from pyrate.selection import group_by_fixtures, select_cases
+from pyrate.util import VariableScope, escape_variables
+
+# The coordinator and its workers talk through a stream socket, every
+# message is one JSON object on a line of its own:
+#
+#   worker        -> coordinator  {"type": "ready"}
+#   coordinator   -> worker       {"type": "case", "id": ..., "spec": [...]}
+#                                 {"type": "done"}
+#   worker        -> coordinator  {"type": "step", "id": ..., ...}
+#                                 {"type": "result", "id": ..., ...}
+
+# seconds a worker keeps trying to reach the coordinator
+CONNECT_TIMEOUT = 10
+
+# times a case is handed out again after its worker was lost, a case which
+# takes down every worker it runs on fails after that
+MAX_REQUEUES = 2
+
+RESULT_FIELDS = ('success', 'exitcode', 'timed_out', 'aborted', 'cached',
+                 'attempts', 'stdout', 'stderr', 'duration', 'spawn', 'wall',
+                 'cpu_user', 'cpu_sys', 'max_rss', 'children', 'resolve',
+                 'validate', 'failure')
+
+
+def parse_address(address):
+    # 'unix:PATH' or 'HOST:PORT', an empty host means the loopback
+    # interface. Workers get the resolved variables of the cases and aren't
+    # authenticated, so listening on other interfaces has to be asked for
+    # with an explicit host, e.g. 0.0.0.0:PORT on a trusted network.
+    if address.startswith('unix:'):
+        return socket.AF_UNIX, address[len('unix:'):]
+    host, _, port = address.rpartition(':')
+    if not port.isdigit():
+        raise ValueError("address must be HOST:PORT or unix:PATH")
+    return socket.AF_INET, (host or '127.0.0.1', int(port))
+
+
+class Connection:
+    # a socket carrying JSON lines
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.file = sock.makefile('rwb')
+        self.lock = threading.Lock()
+
+    def send(self, message):
+        data = json.dumps(message).encode('utf-8') + b'\n'
+        with self.lock:
+            self.file.write(data)
+            self.file.flush()
+
+    def receive(self):
+        # returns None once the peer is gone
+        line = self.file.readline()
+        if not line:
+            return None
+        return json.loads(line.decode('utf-8'))
+
+    def close(self):
+        try:
+            self.file.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+
+def case_payloads(testspec, spec):
+    # One self-contained specification per test case: the global variables
+    # resolved, the shared steps and fixtures the case uses and the case
+    # itself. A worker sets up a session fixture once for all cases it runs.
+    variables = VariableScope(spec.variables)
+    resolved = dict((name, escape_variables(variables.resolve(value)))
+                    for name, value in spec.variables.items())
+
+    shared = {}
+    shared_fixtures = {}
+    cases = []
+    for item in testspec:
+        for key, value in item.items():
+            if key == TestStep.KEY:
+                shared[value.get(TestStep.KEY_NAME)] = item
+            elif key == Fixture.KEY:
+                shared_fixtures[value.get(Fixture.KEY_NAME)] = item
+            elif key == TestCase.KEY:
+                cases.append(item)
+
+    # a case of a matrix is sent with a matrix of its own combination only
+    items = []
+    for item in cases:
+        definition = item[TestCase.KEY]
+        if TestCase.KEY_MATRIX not in definition:
+            items.append(item)
+            continue
+        matrix = Matrix(definition[TestCase.KEY_MATRIX], TestCase.KEY)
+        for values in matrix.combinations():
+            single = dict(definition)
+            single[TestCase.KEY_MATRIX] = dict((name, [value]) for name, value
+                                               in values.items())
+            items.append({TestCase.KEY: single})
+
+    payloads = []
+    for case, item in zip(spec.cases, items):
+        used = list(case.steps)
+        for fixture in case.fixtures:
+            for steps in (fixture.setup, fixture.teardown):
+                if steps is not None:
+                    used.extend(steps.steps)
+        names = []
+        for step in used:
+            if spec.steps.get(step.name) is step.step and \
+                    step.name not in names:
+                names.append(step.name)
+        payloads.append([{env.KEY: resolved}] +
+                        [shared[name] for name in names] +
+                        [shared_fixtures[fixture.name]
+                         for fixture in case.fixtures] + [item])
+    return payloads
+
+
+def result_message(result):
+    return dict((field, getattr(result, field)) for field in RESULT_FIELDS)
+
+
+def error_message(index, text):
+    # the result of a case which couldn't be run
+    return {'type': 'result', 'id': index, 'success': False, 'failed': 1,
+            'broken': None, 'duration': 0, 'steps': [], 'output': text}
+
+
+def message_result(message):
+    result = StepResult()
+    for field in RESULT_FIELDS:
+        setattr(result, field, message[field])
+    return result
+
+
+class Coordinator:
+    # Hands out the test cases to any number of workers and collects their
+    # results. Workers ask for a case whenever they are free, the case of a
+    # worker which disconnects is handed out again a few times before it
+    # fails. The output of the cases is printed in the same order as in a
+    # local run, and a fatal failure stops handing out further cases.
+
+    def __init__(self, path, address, patterns=None):
+        with open(path, 'rb') as spec_file:
+            testspec = yaml.load(spec_file.read(), Loader=Loader)
+        self.spec = parse_spec(testspec)
+        VariableScope(self.spec.variables).check()
+        payloads = case_payloads(testspec, self.spec)
+
+        # the cases in the order of a local run, which keeps the cases using
+        # the same session fixtures together
+        self.cases = group_by_fixtures(self.spec.cases)
+        positions = dict((id(case), index)
+                         for index, case in enumerate(self.spec.cases))
+        self.payloads = [payloads[positions[id(case)]]
+                         for case in self.cases]
+
+        # the indexes of the cases to run
+        selected = self.cases
+        if patterns:
+            selected = select_cases(self.cases, patterns)
+        self.pending = [index for index, case in enumerate(self.cases)
+                        if case in selected]
+        self.running = set()
+        self.selected = set(self.pending)
+        self.requeued = {}
+
+        self.outputs = {}
+        # reporter events of the cases, replayed when the output is printed
+        self.events = {}
+        self.next_output = 0
+        self.fatal_index = len(self.cases)
+        self.condition = threading.Condition()
+        self.address = address
+        self.listener = None
+
+    def listen(self):
+        family, address = parse_address(self.address)
+        self.listener = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_UNIX:
+            if os.path.exists(address):
+                os.unlink(address)
+        else:
+            self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR,
+                                     1)
+        self.listener.bind(address)
+        self.listener.listen()
+
+    def run(self):
+        if self.listener is None:
+            self.listen()
+        thread = threading.Thread(target=self.accept, daemon=True)
+        thread.start()
+
+        with self.condition:
+            while self.pending or self.running:
+                self.condition.wait()
+        self.listener.close()
+        return [self.cases[index] for index in sorted(self.selected)]
+
+    def accept(self):
+        while True:
+            try:
+                sock, _ = self.listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.serve, args=(Connection(sock),),
+                             daemon=True).start()
+
+    def next_case(self):
+        # blocks until there is a case to run, returns None once all are
+        # done
+        with self.condition:
+            while not self.pending and self.running:
+                self.condition.wait()
+            if not self.pending:
+                return None
+            index = self.pending.pop(0)
+            self.running.add(index)
+            self.events[index] = [('case_started', (self.cases[index],))]
+            return index
+
+    def serve(self, connection):
+        index = None
+        try:
+            while True:
+                message = connection.receive()
+                if message is None:
+                    return
+
+                if message['type'] == 'ready':
+                    index = self.next_case()
+                    if index is None:
+                        connection.send({'type': 'done'})
+                        return
+                    connection.send({'type': 'case', 'id': index,
+                                     'spec': self.payloads[index]})
+                elif message['type'] == 'step':
+                    self.step_finished(message)
+                elif message['type'] == 'result':
+                    self.case_finished(message)
+                    index = None
+        except (OSError, ValueError):
+            pass
+        finally:
+            connection.close()
+            if index is not None:
+                self.requeue(index)
+
+    def requeue(self, index):
+        # the worker is gone, the case runs again on another one
+        with self.condition:
+            if index not in self.running:
+                return
+            self.requeued[index] = self.requeued.get(index, 0) + 1
+            if self.requeued[index] <= MAX_REQUEUES:
+                self.running.discard(index)
+                self.events.pop(index, None)
+                self.cases[index].reset()
+                self.pending.insert(0, index)
+                self.condition.notify_all()
+                return
+            self.cases[index].reset()
+            self.events[index] = [('case_started', (self.cases[index],))]
+        self.case_finished(error_message(
+            index, "%s: lost the worker %d times, giving up\n" %
+            (self.cases[index].name, self.requeued[index])))
+
+    def step_finished(self, message):
+        case = self.cases[message['id']]
+        step = case.steps[message['step']]
+        with self.condition:
+            events = self.events.get(message['id'])
+            if events is not None:
+                events.append(('step_finished',
+                               (case, step, message['description'],
+                                message_result(message['result']))))
+
+    def case_finished(self, message):
+        index = message['id']
+        case = self.cases[index]
+
+        with self.condition:
+            if index > self.fatal_index:
+                # a serial run wouldn't have executed it
+                self.running.discard(index)
+                self.events.pop(index, None)
+                self.condition.notify_all()
+                return
+
+        case.executed = True
+        case.failed = message['failed']
+        case.broken = message['broken']
+        case.duration = message['duration']
+        for step, state in zip(case.steps, message['steps']):
+            step.executed, step.failed, step.duration = state
+
+        with self.condition:
+            self.events[index].append(('case_finished',
+                                       (case, case.duration)))
+            self.running.discard(index)
+            if not message['success'] and case.fatal and \
+                    index < self.fatal_index:
+                # nothing behind a fatal failure runs, like in a local run
+                self.fatal_index = index
+                for later in self.pending:
+                    self.cases[later].reset()
+                self.pending = []
+                # cases behind it which finished earlier don't count either
+                for later in self.outputs:
+                    if later > index:
+                        self.cases[later].reset()
+            self.outputs[index] = message['output']
+            self.publish()
+            self.condition.notify_all()
+
+    def publish(self):
+        # print everything which is complete in the order of the cases
+        while self.next_output < len(self.cases):
+            if self.next_output not in self.selected or \
+                    self.next_output > self.fatal_index:
+                self.events.pop(self.next_output, None)
+                self.next_output += 1
+                continue
+            if self.next_output not in self.outputs:
+                return
+            sys.stdout.write(self.outputs.pop(self.next_output))
+            sys.stdout.flush()
+            reporters.replay(self.events.pop(self.next_output, []))
+            self.next_output += 1
+
+
+class StepForwarder(Reporter):
+    # sends the results of the steps of a worker to the coordinator
+
+    def __init__(self):
+        self.connections = {}
+
+    def step_finished(self, testcase, step, description, result):
+        connection, index = self.connections[id(testcase)]
+        connection.send({'type': 'step', 'id': index,
+                         'step': testcase.steps.index(step),
+                         'description': description,
+                         'result': result_message(result)})
+
+
+def connect(address):
+    family, address = parse_address(address)
+    deadline = time.monotonic() + CONNECT_TIMEOUT
+    while True:
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        try:
+            sock.connect(address)
+            return Connection(sock)
+        except OSError:
+            sock.close()
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def run_case(connection, message, forwarder, output):
+    spec = parse_spec(message['spec'])
+    case = spec.cases[0]
+    forwarder.connections[id(case)] = (connection, message['id'])
+
+    output.begin()
+    try:
+        success = case.run(VariableScope(spec.variables))
+    finally:
+        text = output.end()
+        del forwarder.connections[id(case)]
+    output.emit("%s: %s\n" % (case.name,
+                              'failed' if case.failed else 'passed'))
+
+    return {'type': 'result', 'id': message['id'], 'success': success,
+            'failed': case.failed, 'broken': case.broken,
+            'duration': case.duration,
+            'steps': [(step.executed, step.failed, step.duration)
+                      for step in case.steps],
+            'output': text}
+
+
+def work(connection, forwarder, output):
+    # runs cases for the coordinator until it has no more
+    try:
+        while True:
+            connection.send({'type': 'ready'})
+            message = connection.receive()
+            if message is None or message['type'] != 'case':
+                return
+
+            try:
+                result = run_case(connection, message, forwarder, output)
+            except Exception as e:
+                # e.g. a specification this worker can't parse, the case
+                # fails instead of being handed to the next worker
+                result = error_message(message['id'], traceback.format_exc())
+                output.emit("case %d: error: %s\n" % (message['id'], e))
+            connection.send(result)
+    except OSError as e:
+        print("Lost the coordinator: %s" % e, file=sys.stderr)
+    finally:
+        connection.close()
+
+
+def run_worker(address, jobs=1):
+    # every job is a connection of its own asking for work
+    connections = [connect(address) for _ in range(max(jobs, 1))]
+    forwarder = StepForwarder()
+    reporters.add(forwarder)
+    output = ThreadOutput(sys.stdout)
+    sys.stdout = output
+    try:
+        threads = [threading.Thread(target=work,
+                                    args=(connection, forwarder, output),
+                                    daemon=True)
+                   for connection in connections]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        # the session fixtures set up for the cases of this worker
+        fixtures.close()
+        sys.stdout = output.stream
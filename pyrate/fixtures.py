@@ -0,0 +1,192 @@
+#
+# Copyright (C) 2015 BMW Car IT GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+import asyncio
+import copy
+import os
+import tempfile
+import threading
+
+from pyrate.util import VariableScope, escape_variables
+
+
+def read_exports(path):
+    # the NAME=value lines written by a setup, later ones win
+    exports = {}
+    try:
+        with open(path, 'r', encoding='utf-8', errors='replace') as lines:
+            for line in lines:
+                name, separator, value = line.rstrip('\n').partition('=')
+                if separator and name.strip():
+                    exports[name.strip()] = escape_variables(value)
+    except OSError:
+        pass
+    return exports
+
+
+def run_copy(template, variables):
+    # Runs a copy of the setup or teardown of a fixture, the same one may
+    # run for several cases at the same time. Returns whether it passed.
+    shared = dict((id(step.step), step.step) for step in template.steps)
+    case = copy.deepcopy(template, shared)
+    case.run(variables)
+    return not case.failed
+
+
+class Lease:
+    # the fixtures of a running test case
+
+    def __init__(self, variables):
+        # the variables of the run, without any exports
+        self.base = variables
+        # the variables with the exports of all fixtures of the case
+        self.variables = variables
+        # the name of the fixture which failed, if any
+        self.failed = None
+        # case fixtures which were set up, with their exports
+        self.held = []
+
+
+class SessionState:
+    # a session fixture during a run
+
+    def __init__(self, fixture):
+        self.fixture = fixture
+        self.lock = threading.Lock()
+        self.ready = False
+        # None if the setup failed
+        self.exports = None
+        self.variables = None
+        # planned cases which didn't finish yet, None if not known
+        self.users = None
+
+
+class FixtureManager:
+    # Sets up the fixtures of a test case before it starts and tears the
+    # case fixtures down after it finished, whatever happened to it. A
+    # session fixture is set up by the first case which needs it, the others
+    # wait for it. It's torn down once the last planned case using it
+    # finished, close() tears down those still set up, e.g. after a fatal
+    # failure or an interruption.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sessions = {}
+
+    def session(self, fixture):
+        with self.lock:
+            state = self.sessions.get(fixture.name)
+            if state is None:
+                state = SessionState(fixture)
+                self.sessions[fixture.name] = state
+            return state
+
+    def plan(self, cases):
+        for case in cases:
+            for fixture in case.fixtures:
+                if fixture.session:
+                    state = self.session(fixture)
+                    state.users = (state.users or 0) + 1
+
+    def acquire(self, case, variables):
+        if not isinstance(variables, VariableScope):
+            variables = VariableScope(variables)
+        lease = Lease(variables)
+        if not case.fixtures:
+            return lease
+
+        exports = {}
+        for fixture in case.fixtures:
+            if fixture.session:
+                state = self.session(fixture)
+                with state.lock:
+                    if not state.ready:
+                        state.ready = True
+                        state.variables = variables
+                        state.exports = self.setup(fixture, variables)
+                    result = state.exports
+            else:
+                result = self.setup(fixture, variables)
+                lease.held.append((fixture, result or {}))
+
+            if result is None:
+                lease.failed = fixture.name
+                return lease
+            exports.update(result)
+
+        lease.variables = variables.child(exports)
+        return lease
+
+    def release(self, case, lease):
+        for fixture, exports in reversed(lease.held):
+            self.teardown(fixture, lease.base.child(exports))
+
+        for fixture in case.fixtures:
+            if fixture.session:
+                state = self.session(fixture)
+                with state.lock:
+                    if state.users is not None:
+                        state.users -= 1
+                        if state.users <= 0:
+                            self.finish(state)
+
+    async def acquire_async(self, case, variables):
+        # fixtures are run by the thread engine outside of the event loop
+        if not case.fixtures:
+            return self.acquire(case, variables)
+        return await asyncio.to_thread(self.acquire, case, variables)
+
+    async def release_async(self, case, lease):
+        if case.fixtures:
+            await asyncio.to_thread(self.release, case, lease)
+
+    def setup(self, fixture, variables):
+        # returns the exported variables or None if the setup failed
+        descriptor, path = tempfile.mkstemp(prefix='pyrate-export-')
+        os.close(descriptor)
+        try:
+            passed = run_copy(fixture.setup,
+                              variables.child({fixture.EXPORT: path}))
+            exports = read_exports(path)
+        finally:
+            os.unlink(path)
+        return exports if passed else None
+
+    def teardown(self, fixture, variables):
+        if fixture.teardown is not None:
+            run_copy(fixture.teardown, variables)
+
+    def finish(self, state):
+        # with the lock of the state held; a failed setup is torn down as
+        # well, it may have started something before it failed
+        if not state.ready:
+            return
+        state.ready = False
+        state.users = None
+        self.teardown(state.fixture,
+                      state.variables.child(state.exports or {}))
+
+    def close(self):
+        with self.lock:
+            states = list(self.sessions.values())
+            self.sessions = {}
+        for state in states:
+            with state.lock:
+                self.finish(state)
+
+
+fixtures = FixtureManager()
@@ -16,108 +16,419 @@
 #
 
 from __future__ import print_function
+import os
 import sys
 import datetime
 import argparse
 
 import yaml
 
+from pyrate import __version__
+from pyrate.capture import BufferSink
+from pyrate.distributed import Coordinator, run_worker
 from pyrate.exception import ParseException
-from pyrate.model import env
-from pyrate.model.testcase import TestCase
-from pyrate.model.teststep import TestStep
+from pyrate.fixtures import fixtures
+from pyrate.model.graph import StepGraph
+from pyrate.model.retry import RetryPolicy
+from pyrate.model.spec import default_cache_dir, load_spec
+from pyrate.output.reporter import reporters, JsonLinesReporter, \
+    JUnitReporter
+from pyrate.output.flakiness import FlakinessReporter
+from pyrate.output.profile import ProfileReporter
+from pyrate.output.summary import Summary
 from pyrate.output.terminal import *
-from pyrate.util import duration
-
-
-__version__ = "0.1"
+from pyrate.output.window import Window
+from pyrate.result_cache import result_cache
+from pyrate.shell_pool import shell_pool
+from pyrate.selection import group_by_fixtures, parse_shard, select_cases
+from pyrate.selection import shard_cases
+from pyrate.state import State
+from pyrate.runner import run_cases, ENGINES, ENGINE_THREAD
+from pyrate.util import duration, VariableCycleException, VariableScope
+from pyrate.validator.guard import regex_guard
+from pyrate.watch import Watcher, affected_cases, watched_directory
 
 
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "merge":
+        sys.exit(merge(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == "coordinator":
+        sys.exit(coordinator(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == "worker":
+        sys.exit(worker(sys.argv[2:]))
 
     parser = argparse.ArgumentParser()
     parser.add_argument("file", help="the test specification")
     parser.add_argument("-d", "--dry",
                         help="dry run (only parse the test specification)",
                         action="store_true")
+    parser.add_argument("-j", "--jobs",
+                        help="number of test cases to run in parallel "
+                             "(0 uses one job per cpu)",
+                        type=int, default=1)
+    parser.add_argument("--filter", metavar="PATTERN", action="append",
+                        help="only run test cases whose name matches the "
+                             "glob PATTERN or, with a 're:' prefix, the "
+                             "regular expression (can be repeated)")
+    parser.add_argument("--shard", metavar="I/N", type=shard,
+                        help="only run the I-th of N shards of the test "
+                             "cases, balanced by the durations in the state "
+                             "file")
+    parser.add_argument("--state", metavar="FILE",
+                        help="file which keeps the durations and results of "
+                             "the test cases between runs")
+    parser.add_argument("--only-failed",
+                        help="only run the test cases which failed in the "
+                             "last run recorded in the state file",
+                        action="store_true")
+    parser.add_argument("--changed",
+                        help="only run the test cases which are new or "
+                             "changed since the last run recorded in the "
+                             "state file (combines with --only-failed)",
+                        action="store_true")
+    parser.add_argument("--failed-first",
+                        help="run the test cases which failed in the last "
+                             "run first",
+                        action="store_true")
+    parser.add_argument("--stats", metavar="FILE",
+                        help="write the statistics of the run, the files "
+                             "of several runs can be combined with "
+                             "'pyrate merge FILE...'")
+    parser.add_argument("--step-jobs", metavar="N", type=int, default=4,
+                        help="number of steps of a test case to run in "
+                             "parallel if the steps declare dependencies "
+                             "(default 4)")
+    parser.add_argument("--retries", metavar="N", type=int, default=0,
+                        help="number of retries of failed steps which "
+                             "don't set 'retries' (default 0)")
+    parser.add_argument("--retry-delay", metavar="MS", type=int, default=0,
+                        help="delay before the first retry of steps which "
+                             "don't set 'retry_delay', doubled for every "
+                             "further one (default 0)")
+    parser.add_argument("--repeat", metavar="N", type=int, default=1,
+                        help="run every test case N times, in parallel with "
+                             "--jobs, and print failure rates and timings "
+                             "of all steps")
+    parser.add_argument("--engine", choices=ENGINES, default=ENGINE_THREAD,
+                        help="'thread' runs test cases on a thread pool, "
+                             "'asyncio' runs all test cases on one thread "
+                             "with at most JOBS processes at a time")
+    parser.add_argument("--persistent-shell",
+                        help="run steps without a 'shell' key in a pool of "
+                             "long-lived shells instead of a new shell per "
+                             "step (thread engine only)",
+                        action="store_true")
+    parser.add_argument("--capture-limit", metavar="MB", type=int,
+                        default=16,
+                        help="output of a step kept in memory, larger output "
+                             "is spilled to a temporary file (default 16)")
+    parser.add_argument("--report-lines", metavar="N", type=int, default=40,
+                        help="lines shown from the start and the end of "
+                             "the output in failure reports, 0 shows "
+                             "everything (default 40)")
+    parser.add_argument("--regex-timeout", metavar="MS", type=int,
+                        default=10000,
+                        help="time limit for a search with a pattern which "
+                             "may backtrack catastrophically, 0 disables "
+                             "the limit (default 10000)")
+    parser.add_argument("--watch",
+                        help="run the test cases again whenever the test "
+                             "specification or the inputs of their steps "
+                             "change",
+                        action="store_true")
+    parser.add_argument("--cache-dir",
+                        help="directory for cached data "
+                             "(default: $XDG_CACHE_HOME/pyrate)")
+    parser.add_argument("--no-cache",
+                        help="neither read nor write the cache of parsed "
+                             "test specifications and step results",
+                        action="store_true")
+    parser.add_argument("--cache-size", metavar="MB", type=int, default=256,
+                        help="maximum size of the cache of step results "
+                             "(default 256)")
+    parser.add_argument("--junit-xml", metavar="FILE",
+                        help="write the results as JUnit XML")
+    parser.add_argument("--json-lines", metavar="FILE",
+                        help="write the results as JSON lines")
+    parser.add_argument("--profile", metavar="N", type=int, nargs="?",
+                        const=10,
+                        help="print timings of the N slowest steps and "
+                             "cases and where the time went (default 10)")
     args = parser.parse_args()
 
-    start = datetime.datetime.now()
+    if (args.only_failed or args.changed or args.failed_first) and \
+            not args.state:
+        parser.error("--only-failed, --changed and --failed-first need "
+                     "--state")
 
-    testspec = yaml.safe_load(open(args.file, "r"))
+    start = datetime.datetime.now()
 
-    steps = {}
-    cases = []
-    variables = {}
+    cache_dir = None
+    if not args.no_cache:
+        cache_dir = args.cache_dir or default_cache_dir()
 
     try:
-        # first find all shared test steps
-        for item in testspec:
-            for key, value in item.items():
-                if key == TestStep.KEY:
-                    new_step = TestStep(value)
-                    steps[new_step.name] = new_step
-
-        # now we can parse all test cases
-        for item in testspec:
-            for key, value in item.items():
-                if key == TestCase.KEY:
-                    new_case = TestCase(value, steps)
-                    cases.append(new_case)
-                elif key == TestStep.KEY:
-                    pass
-                elif key == env.KEY:
-                    variables = env.parse_env(value)
-                else:
-                    raise ParseException("unexpected token '%s'" % key)
-    except ParseException as e:
+        spec = load_spec(args.file, cache_dir)
+        cases = spec.cases
+
+        # global variables are resolved once for all test steps
+        variables = VariableScope(spec.variables)
+        variables.check()
+    except (ParseException, VariableCycleException) as e:
         print("Parse error: %s" % e, file=sys.stderr)
         sys.exit(1)
 
+    state = None
+    if args.state:
+        state = State(args.state, spec.variables)
+
+    cases = select(args, cases, state)
+
     # skip remaining stuff when doing a dry run
     if args.dry:
         print("Parsing the test specification succeeded. "
               "Skip tests due to dry run.")
         sys.exit(0)
 
-    for testcase in cases:
-        if not testcase.run(variables):
-            # break on fatal failure
-            break
+    jobs = args.jobs
+    if jobs <= 0:
+        jobs = os.cpu_count() or 1
 
-    # gather some statistics from the test which were run
-    cases_executed = [case for case in cases if case.executed]
-    cases_failed = [case for case in cases_executed if case.failed]
-    steps_executed = [step for case in cases_executed
-                      for step in case.steps if step.executed]
-    steps_failed = [step for step in steps_executed if step.failed]
-
-    print(STATUS_SEP)
-    print("%s %d tests from %d test cases run. (%d ms total" % (
-        STATUS_END, len(steps_executed),
-        len(cases_executed), duration(start)))
-
-    if len(cases_failed) > 0:
-        message_text_cases = "case"
-        if len(cases_executed) > 1:
-            message_text_cases = "cases"
-        print("%s %d out of %d tests (%d of %d %s) failed" %
-              (STATUS_FAILED, len(steps_failed), len(steps_executed),
-               len(cases_failed), len(cases_executed), message_text_cases))
-        print(STATUS_FAILED)
-
-        message_text_cases = "case"
-        if len(cases_failed) > 1:
-            message_text_cases = "cases"
-        print("%s %d failed %s, listed below:" %
-              (STATUS_FAILED, len(cases_failed), message_text_cases))
-
-        for testcase in cases_failed:
-            print("%s %s" % (STATUS_FAILED, testcase.name))
+    StepGraph.jobs = max(args.step_jobs, 1)
+    BufferSink.limit = args.capture_limit * 1024 * 1024
+    Window.lines = args.report_lines
+    regex_guard.timeout = args.regex_timeout
+    RetryPolicy.default_retries = max(args.retries, 0)
+    RetryPolicy.default_delay = max(args.retry_delay, 0)
+
+    # one shell per running step
+    shell_pool.size = jobs * StepGraph.jobs
+    shell_pool.default = args.persistent_shell
 
+    # results of steps with 'cache' set are reused while their command,
+    # validators and inputs stay the same
+    if cache_dir is not None:
+        result_cache.directory = os.path.join(cache_dir, 'results')
+        result_cache.max_size = args.cache_size * 1024 * 1024
+
+    if args.watch:
+        watch(args, spec, cases, variables, state, jobs)
+    if not execute(args, cases, variables, state, jobs, start):
         sys.exit(1)
-    else:
-        print(STATUS_PASSED)
+
+
+def select(args, cases, state):
+    if args.filter:
+        cases = select_cases(cases, args.filter)
+    if args.only_failed or args.changed:
+        cases = [case for case in cases
+                 if (args.only_failed and state.failed(case)) or
+                 (args.changed and state.changed(case))]
+    if args.shard:
+        durations = dict((case.name, state.duration(case.name)
+                          if state is not None else None)
+                         for case in cases)
+        cases = shard_cases(cases, args.shard[0], args.shard[1], durations)
+    if args.failed_first:
+        cases = sorted(cases, key=lambda case: not state.failed(case))
+    cases = group_by_fixtures(cases)
+    if args.repeat > 1:
+        cases = [repetition for case in cases
+                 for repetition in case.repeated(args.repeat)]
+    return cases
+
+
+def add_reporters(args):
+    # new ones for every run, so each round of watch mode reports on its own
+    reporters.clear()
+    if args.junit_xml:
+        reporters.add(JUnitReporter(args.junit_xml))
+    if args.json_lines:
+        reporters.add(JsonLinesReporter(args.json_lines))
+    reporters.add(FlakinessReporter(args.repeat > 1))
+    if args.profile is not None:
+        reporters.add(ProfileReporter(args.profile))
+
+
+def execute(args, cases, variables, state, jobs, start):
+    add_reporters(args)
+    reporters.start()
+    fixtures.plan(cases)
+    try:
+        run_cases(cases, variables, jobs, args.engine)
+    finally:
+        # session fixtures of cases which didn't run, e.g. after a fatal
+        # failure or an interruption
+        fixtures.close()
+    reporters.finish(duration(start))
+    result_cache.evict()
+
+    # durations of repeated cases running side by side don't tell much
+    if state is not None and args.repeat <= 1:
+        state.record(cases)
+        state.save()
+
+    # gather some statistics from the test which were run
+    summary = Summary.of(cases, duration(start))
+    if args.stats:
+        summary.save(args.stats)
+    return summary.report()
+
+
+def watch(args, spec, cases, variables, state, jobs):
+    # Runs the selected cases, then waits for changes of the specification
+    # or of the declared inputs and runs the cases affected by them again
+    # until interrupted. Unchanged cases are kept from the previous model.
+    path = os.path.abspath(args.file)
+    watcher = Watcher()
+    try:
+        while True:
+            execute(args, cases, variables, state, jobs,
+                    datetime.datetime.now())
+
+            directories = [os.path.dirname(path)]
+            for case in spec.cases:
+                directories += [watched_directory(pattern)
+                                for pattern in case.inputs(variables)]
+            watcher.watch(directories)
+            print("%s waiting for changes" % STATUS_WATCH)
+
+            cases = []
+            while not cases:
+                changed = watcher.wait()
+                affected = []
+                if path in changed:
+                    try:
+                        new_spec = load_spec(args.file, None, spec)
+                        new_variables = VariableScope(new_spec.variables)
+                        new_variables.check()
+                    except (OSError, yaml.YAMLError, ParseException,
+                            VariableCycleException) as e:
+                        print("%s parse error: %s" % (STATUS_WATCH, e))
+                        continue
+
+                    if new_spec.variables != spec.variables:
+                        affected = list(new_spec.cases)
+                    else:
+                        known = set(id(case) for case in spec.cases)
+                        affected = [case for case in new_spec.cases
+                                    if id(case) not in known]
+                        new_variables = variables
+                    spec, variables = new_spec, new_variables
+
+                affected += affected_cases(spec.cases, variables, changed)
+                affected = [case for case in spec.cases if case in affected]
+                cases = select(args, affected, state)
+                print("%s %d changed files, %d test cases to run" %
+                      (STATUS_WATCH, len(changed), len(cases)))
+
+            for case in cases:
+                case.reset()
+    except KeyboardInterrupt:
+        sys.exit(0)
+
+
+def merge(arguments):
+    parser = argparse.ArgumentParser(prog="pyrate merge",
+                                     description="print the summary of runs "
+                                                 "written with --stats")
+    parser.add_argument("stats", nargs="+", help="statistics of a run")
+    args = parser.parse_args(arguments)
+
+    try:
+        summaries = [Summary.load(path) for path in args.stats]
+    except (OSError, ValueError, KeyError) as e:
+        print("Error reading statistics: %s" % e, file=sys.stderr)
+        return 1
+
+    return 0 if Summary.merge(summaries).report() else 1
+
+
+def coordinator(arguments):
+    parser = argparse.ArgumentParser(prog="pyrate coordinator",
+                                     description="hand out the test cases "
+                                                 "to pyrate workers")
+    parser.add_argument("file", help="the test specification")
+    parser.add_argument("--listen", metavar="ADDRESS", required=True,
+                        help="HOST:PORT or unix:PATH to wait for workers on, "
+                             "an empty HOST means localhost. Workers are not "
+                             "authenticated and get the resolved variables, "
+                             "only listen on a trusted network")
+    parser.add_argument("--filter", metavar="PATTERN", action="append",
+                        help="only run test cases whose name matches the "
+                             "glob PATTERN or, with a 're:' prefix, the "
+                             "regular expression (can be repeated)")
+    parser.add_argument("--junit-xml", metavar="FILE",
+                        help="write the results as JUnit XML")
+    parser.add_argument("--json-lines", metavar="FILE",
+                        help="write the results as JSON lines")
+    parser.add_argument("--stats", metavar="FILE",
+                        help="write the statistics of the run")
+    args = parser.parse_args(arguments)
+
+    start = datetime.datetime.now()
+    try:
+        runner = Coordinator(args.file, args.listen, args.filter)
+        runner.listen()
+    except (ParseException, VariableCycleException) as e:
+        print("Parse error: %s" % e, file=sys.stderr)
+        return 1
+    except (OSError, ValueError) as e:
+        print("Error listening on %s: %s" % (args.listen, e),
+              file=sys.stderr)
+        return 1
+
+    if args.junit_xml:
+        reporters.add(JUnitReporter(args.junit_xml))
+    if args.json_lines:
+        reporters.add(JsonLinesReporter(args.json_lines))
+
+    reporters.start()
+    cases = runner.run()
+    reporters.finish(duration(start))
+
+    summary = Summary.of(cases, duration(start))
+    if args.stats:
+        summary.save(args.stats)
+    return 0 if summary.report() else 1
+
+
+def worker(arguments):
+    parser = argparse.ArgumentParser(prog="pyrate worker",
+                                     description="run test cases for a "
+                                                 "pyrate coordinator")
+    parser.add_argument("address", help="HOST:PORT or unix:PATH of the "
+                                        "coordinator")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="number of test cases to run in parallel")
+    parser.add_argument("--persistent-shell",
+                        help="run steps without a 'shell' key in a pool of "
+                             "long-lived shells",
+                        action="store_true")
+    parser.add_argument("--regex-timeout", metavar="MS", type=int,
+                        default=10000,
+                        help="time limit for a search with a pattern which "
+                             "may backtrack catastrophically, 0 disables "
+                             "the limit (default 10000)")
+    args = parser.parse_args(arguments)
+
+    regex_guard.timeout = args.regex_timeout
+    shell_pool.size = max(args.jobs, 1) * StepGraph.jobs
+    shell_pool.default = args.persistent_shell
+    try:
+        run_worker(args.address, args.jobs)
+    except (OSError, ValueError) as e:
+        print("Error connecting to %s: %s" % (args.address, e),
+              file=sys.stderr)
+        return 1
+    return 0
+
+
+def shard(text):
+    try:
+        return parse_shard(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,52 @@
+#
+# Copyright (C) 2015 BMW Car IT GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from pyrate.exception import ParseException
+
+
+class CacheOptions:
+    KEY = 'cache'
+    KEY_INPUTS = 'inputs'
+    KEY_ENV = 'env'
+
+    def __init__(self, yaml_tree):
+        # files (or glob patterns) and environment variables the result of
+        # the step depends on besides its command
+        self.inputs = []
+        self.env = []
+
+        if type(yaml_tree) is bool:
+            return
+        if type(yaml_tree) is not dict:
+            raise ParseException("%s must be bool or dict" % self.KEY)
+
+        for key, value in yaml_tree.items():
+            if key == self.KEY_INPUTS:
+                self.inputs = self.names(key, value)
+            elif key == self.KEY_ENV:
+                self.env = self.names(key, value)
+            else:
+                raise ParseException("%s: unexpected token '%s'" %
+                                     (self.KEY, key))
+
+    def names(self, key, value):
+        if type(value) is str:
+            value = [value]
+        if type(value) is not list or \
+                any(type(item) is not str for item in value):
+            raise ParseException("%s: %s must be a string or a list of "
+                                 "strings" % (self.KEY, key))
+        return value
@@ -14,6 +14,9 @@
 # limitations under the License.
 #
 
+import hashlib
+import json
+
 from pyrate.exception import ParseException
 
 
@@ -24,3 +27,13 @@ def needs_token(field, item, token, name=None):
         else:
             message = "%s '%s' needs %s" % (item, name, token)
         raise ParseException(message)
+
+
+def definition_digest(yaml_tree, *digests):
+    # identifies a parsed definition, together with the digests of the
+    # definitions it uses
+    digest = hashlib.sha256(json.dumps(yaml_tree, sort_keys=True,
+                                       default=str).encode('utf-8'))
+    for other in digests:
+        digest.update(other.encode('ascii'))
+    return digest.hexdigest()
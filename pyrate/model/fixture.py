@@ -0,0 +1,85 @@
+#
+# Copyright (C) 2015 BMW Car IT GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+from pyrate.exception import ParseException
+from pyrate.model.common import definition_digest, needs_token
+from pyrate.model.testcase import TestCase
+
+
+class Fixture:
+    # Setup and teardown steps shared by the test cases which declare the
+    # fixture. A 'session' fixture is set up once for all of them, a 'case'
+    # fixture for each of them. The setup exports variables to the cases by
+    # appending NAME=value lines to the file named by {PYRATE_EXPORT}. The
+    # steps are kept as test cases of their own, see pyrate.fixtures.
+
+    KEY = 'fixture'
+    KEY_NAME = 'name'
+    KEY_SCOPE = 'scope'
+    KEY_SETUP = 'setup'
+    KEY_TEARDOWN = 'teardown'
+
+    SCOPE_SESSION = 'session'
+    SCOPE_CASE = 'case'
+
+    # the variable naming the file for exported variables
+    EXPORT = 'PYRATE_EXPORT'
+
+    def __init__(self, yaml_tree, shared_steps):
+        self.name = None
+        self.scope = self.SCOPE_CASE
+        self.setup = None
+        self.teardown = None
+
+        if type(yaml_tree) is not dict:
+            raise ParseException("%s must be a dict" % self.KEY)
+
+        self.name = yaml_tree.get(self.KEY_NAME)
+        for key, value in yaml_tree.items():
+            if key == self.KEY_NAME:
+                pass
+            elif key == self.KEY_SCOPE:
+                if value not in (self.SCOPE_SESSION, self.SCOPE_CASE):
+                    raise ParseException("%s '%s': %s must be '%s' or '%s'" %
+                                         (self.KEY, self.name, key,
+                                          self.SCOPE_SESSION,
+                                          self.SCOPE_CASE))
+                self.scope = value
+            elif key in (self.KEY_SETUP, self.KEY_TEARDOWN):
+                case = TestCase({TestCase.KEY_NAME: "%s (%s)" % (self.name,
+                                                                 key),
+                                 TestCase.KEY_STEPS: value}, shared_steps)
+                # the steps are part of the cases using the fixture
+                case.reported = False
+                if key == self.KEY_SETUP:
+                    self.setup = case
+                else:
+                    self.teardown = case
+            else:
+                raise ParseException("%s (%s): Unknown token '%s'" % (
+                    self.KEY, self.name, key))
+
+        needs_token(self.name, self.KEY, self.KEY_NAME, self.name)
+        needs_token(self.setup, self.KEY, self.KEY_SETUP, self.name)
+
+        self.digest = definition_digest(yaml_tree, *[
+            case.digest for case in (self.setup, self.teardown)
+            if case is not None])
+
+    @property
+    def session(self):
+        return self.scope == self.SCOPE_SESSION
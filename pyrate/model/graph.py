@@ -0,0 +1,228 @@
+#
+# Copyright (C) 2015 BMW Car IT GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import asyncio
+import contextvars
+import copy
+import sys
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from pyrate.exception import ParseException
+from pyrate.output.buffer import ThreadOutput
+from pyrate.output.terminal import STATUS_SKIPPED
+
+
+class StepGraph:
+    # The dependencies between the steps of a test case which declares
+    # 'needs' or 'after' for any of its steps. A step runs once all steps it
+    # comes after are done, steps it needs also have to pass, otherwise it
+    # is skipped. A step without declarations comes after all steps in front
+    # of it, like in a sequential run. Up to 'jobs' ready steps run at the
+    # same time.
+
+    jobs = 4
+
+    def __init__(self, case_name, steps):
+        self.steps = steps
+
+        indexes = {}
+        for index, step in enumerate(steps):
+            indexes.setdefault(step.name, []).append(index)
+
+        def resolve(names, key):
+            result = []
+            for name in names:
+                if name not in indexes:
+                    raise ParseException("testcase '%s': %s of step '%s' "
+                                         "refers to unknown step '%s'" %
+                                         (case_name, key, step.name, name))
+                if len(indexes[name]) > 1:
+                    raise ParseException("testcase '%s': %s of step '%s' "
+                                         "refers to ambiguous step '%s'" %
+                                         (case_name, key, step.name, name))
+                result.append(indexes[name][0])
+            return result
+
+        self.needs = []
+        self.after = []
+        for index, step in enumerate(steps):
+            template = step.step
+            if template.needs is None and template.after is None:
+                needs = []
+                after = set(range(index))
+            else:
+                needs = resolve(template.needs or [], 'needs')
+                after = set(needs + resolve(template.after or [], 'after'))
+            self.needs.append(needs)
+            self.after.append(after)
+
+        self.order = self.sort(case_name)
+
+    def of_steps(self, steps):
+        # the same graph for a copy of the steps
+        graph = copy.copy(self)
+        graph.steps = steps
+        return graph
+
+    @classmethod
+    def of(cls, case_name, steps):
+        # returns None if the steps simply run one after another
+        for step in steps:
+            if step.step.needs is not None or step.step.after is not None:
+                return cls(case_name, steps)
+        return None
+
+    def sort(self, case_name):
+        order = []
+        remaining = dict((index, set(after))
+                         for index, after in enumerate(self.after))
+        while remaining:
+            ready = sorted(index for index, after in remaining.items()
+                           if not after)
+            if not ready:
+                names = [self.steps[index].name for index in remaining]
+                raise ParseException("testcase '%s': steps depend on each "
+                                     "other: %s" %
+                                     (case_name, ', '.join(names)))
+            for index in ready:
+                del remaining[index]
+                order.append(index)
+            for after in remaining.values():
+                after.difference_update(ready)
+        return order
+
+    def critical_path(self):
+        # the chain of executed steps which took the longest in total
+        longest = {}
+        for index in self.order:
+            step = self.steps[index]
+            if not step.executed:
+                continue
+            total, path = max((longest[previous]
+                               for previous in self.after[index]
+                               if previous in longest),
+                              default=(0, []), key=lambda entry: entry[0])
+            longest[index] = (total + step.duration, path + [index])
+
+        total, path = max(longest.values(), default=(0, []),
+                          key=lambda entry: entry[0])
+        return [self.steps[index] for index in path], total
+
+    def run(self, testcase, variables, cancel=None):
+        output, installed = self.output()
+        schedule = Schedule(self, testcase, cancel)
+        try:
+            with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                running = {}
+                while True:
+                    for index in schedule.ready(len(running)):
+                        context = contextvars.copy_context()
+                        future = executor.submit(context.run, output.capture,
+                                                 self.steps[index].run,
+                                                 testcase, variables, cancel)
+                        running[future] = index
+                    if not running:
+                        break
+
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        schedule.complete(running.pop(future),
+                                          future.result())
+        finally:
+            if installed:
+                sys.stdout = output.stream
+        return schedule.success
+
+    async def run_async(self, testcase, variables, engine, cancel=None):
+        output, installed = self.output()
+        schedule = Schedule(self, testcase, cancel)
+        try:
+            running = {}
+            while True:
+                for index in schedule.ready(len(running)):
+                    # every task runs in a copy of the current context
+                    task = asyncio.ensure_future(output.capture_async(
+                        self.steps[index].run_async, testcase, variables,
+                        engine, cancel))
+                    running[task] = index
+                if not running:
+                    break
+
+                done, _ = await asyncio.wait(running,
+                                             return_when=FIRST_COMPLETED)
+                for task in done:
+                    schedule.complete(running.pop(task), task.result())
+        finally:
+            if installed:
+                sys.stdout = output.stream
+        return schedule.success
+
+    def output(self):
+        # the output of every step is printed as a whole once it is done
+        if isinstance(sys.stdout, ThreadOutput):
+            return sys.stdout, False
+        sys.stdout = ThreadOutput(sys.stdout)
+        return sys.stdout, True
+
+
+class Schedule:
+    # the progress of one run of a StepGraph
+
+    def __init__(self, graph, testcase, cancel):
+        self.graph = graph
+        self.testcase = testcase
+        self.cancel = cancel
+        self.pending = list(range(len(graph.steps)))
+        # index -> whether the step passed, for steps which are done
+        self.passed = {}
+        self.success = True
+
+    def ready(self, running):
+        # returns the steps to start now and skips the ones which can't run
+        # anymore because a step they need didn't pass
+        started = []
+        changed = True
+        while changed and self.success:
+            changed = False
+            if self.cancel is not None and self.cancel.cancelled:
+                break
+
+            for index in list(self.pending):
+                if not all(previous in self.passed
+                           for previous in self.graph.after[index]):
+                    continue
+
+                failed = [self.graph.steps[previous].name
+                          for previous in self.graph.needs[index]
+                          if not self.passed[previous]]
+                if failed:
+                    print("%s %s: %s (needs %s)" %
+                          (STATUS_SKIPPED, self.testcase.name,
+                           self.graph.steps[index].name,
+                           ', '.join("'%s'" % name for name in failed)))
+                    self.passed[index] = False
+                    self.pending.remove(index)
+                    changed = True
+                elif running + len(started) < self.graph.jobs:
+                    started.append(index)
+                    self.pending.remove(index)
+        return started
+
+    def complete(self, index, success):
+        self.passed[index] = not self.graph.steps[index].failed
+        if not success:
+            # a fatal step failed, nothing else gets started
+            self.success = False
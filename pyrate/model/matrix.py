@@ -0,0 +1,99 @@
+#
+# Copyright (C) 2015 BMW Car IT GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+import itertools
+
+from pyrate.exception import ParseException
+
+SCALARS = (str, int, float, bool)
+
+
+class Matrix:
+    # The parameter grid of a test case or of a reference to a shared step:
+    # the cartesian product of the values of all axes without the
+    # combinations matching an 'exclude' entry, plus the combinations listed
+    # under 'include'. An exclude entry matches a combination if all the
+    # values it names are equal. The combinations are generated one by one,
+    # the grid is never built as a whole.
+
+    KEY = 'matrix'
+    KEY_INCLUDE = 'include'
+    KEY_EXCLUDE = 'exclude'
+
+    def __init__(self, yaml_tree, owner):
+        # owner describes where the matrix is used, for error messages
+        self.axes = []
+        self.include = []
+        self.exclude = []
+
+        if type(yaml_tree) is not dict:
+            raise ParseException("%s: %s must be a dict" % (owner, self.KEY))
+
+        for key, value in yaml_tree.items():
+            if key == self.KEY_INCLUDE:
+                self.include = self.entries(key, value, owner)
+            elif key == self.KEY_EXCLUDE:
+                self.exclude = self.entries(key, value, owner)
+            else:
+                if type(value) is not list or not value or \
+                        any(type(item) not in SCALARS for item in value):
+                    raise ParseException("%s: %s '%s' must be a non-empty "
+                                         "list of values" %
+                                         (owner, self.KEY, key))
+                self.axes.append((str(key), [str(item) for item in value]))
+
+        if not self.axes and not self.include:
+            raise ParseException("%s: %s has no values" % (owner, self.KEY))
+
+    def entries(self, key, value, owner):
+        if type(value) is not list or any(type(item) is not dict or
+                                          not item for item in value):
+            raise ParseException("%s: %s %s must be a list of dicts" %
+                                 (owner, self.KEY, key))
+        entries = []
+        for item in value:
+            if any(type(scalar) not in SCALARS for scalar in item.values()):
+                raise ParseException("%s: %s %s values must be scalars" %
+                                     (owner, self.KEY, key))
+            entries.append(dict((str(name), str(scalar))
+                                for name, scalar in item.items()))
+        return entries
+
+    def excluded(self, values):
+        for entry in self.exclude:
+            if all(values.get(name) == value for name, value in entry.items()):
+                return True
+        return False
+
+    def combinations(self):
+        # yields a dict of variable name -> value per combination
+        if self.axes:
+            names = [name for name, _ in self.axes]
+            for product in itertools.product(*[values
+                                               for _, values in self.axes]):
+                values = dict(zip(names, product))
+                if not self.excluded(values):
+                    yield values
+        for entry in self.include:
+            yield dict(entry)
+
+    @staticmethod
+    def label(values):
+        # the stable suffix of the name of a combination, independent of
+        # its position in the grid
+        return '[%s]' % ', '.join('%s=%s' % (name, values[name])
+                                  for name in sorted(values))
@@ -0,0 +1,77 @@
+#
+# Copyright (C) 2015 BMW Car IT GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+import math
+import re
+
+from pyrate.exception import ParseException
+
+PERCENTILE = re.compile(r'^p(\d{1,2})$')
+
+
+class RepeatOptions:
+    # Runs a step several times to take its measurements. The output and
+    # exit status of every run are checked, the resource limits against the
+    # median or a percentile over all runs, which is less noisy than a
+    # single run.
+
+    KEY = 'repeat'
+    KEY_COUNT = 'count'
+    KEY_STATISTIC = 'statistic'
+
+    MEDIAN = 'median'
+
+    def __init__(self, yaml_tree):
+        self.count = 1
+        self.statistic = self.MEDIAN
+
+        if type(yaml_tree) is int:
+            self.count = yaml_tree
+        elif type(yaml_tree) is dict:
+            for key, value in yaml_tree.items():
+                if key == self.KEY_COUNT:
+                    self.count = value
+                elif key == self.KEY_STATISTIC:
+                    self.statistic = value
+                else:
+                    raise ParseException("%s: unexpected token '%s'" %
+                                         (self.KEY, key))
+        else:
+            raise ParseException("%s must be int or dict" % self.KEY)
+
+        if type(self.count) is not int or self.count < 1:
+            raise ParseException("%s: %s must be a positive integer" %
+                                 (self.KEY, self.KEY_COUNT))
+        if self.statistic != self.MEDIAN and \
+                not (type(self.statistic) is str and
+                     PERCENTILE.match(self.statistic)):
+            raise ParseException("%s: %s must be '%s' or a percentile like "
+                                 "'p90'" % (self.KEY, self.KEY_STATISTIC,
+                                            self.MEDIAN))
+
+    def aggregate(self, values):
+        values = sorted(values)
+        if self.statistic == self.MEDIAN:
+            middle = len(values) // 2
+            if len(values) % 2:
+                return values[middle]
+            return (values[middle - 1] + values[middle]) / 2.0
+
+        # nearest rank
+        percentile = int(PERCENTILE.match(self.statistic).group(1))
+        rank = max(int(math.ceil(percentile / 100.0 * len(values))), 1)
+        return values[rank - 1]
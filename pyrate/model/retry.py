@@ -0,0 +1,96 @@
+#
+# Copyright (C) 2015 BMW Car IT GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from pyrate.exception import ParseException
+
+
+class RetryPolicy:
+    # When to run a failed step again. The delay before the first retry is
+    # multiplied by the backoff factor for every further one. Without
+    # 'retry_on' every failure is retried, otherwise only timeouts and/or
+    # the listed exit codes.
+
+    KEY_RETRIES = 'retries'
+    KEY_DELAY = 'retry_delay'
+    KEY_BACKOFF = 'retry_backoff'
+    KEY_ON = 'retry_on'
+    KEYS = (KEY_RETRIES, KEY_DELAY, KEY_BACKOFF, KEY_ON)
+
+    ON_TIMEOUT = 'timeout'
+
+    # defaults for steps which don't set them, given on the command line
+    default_retries = 0
+    default_delay = 0
+    default_backoff = 2.0
+
+    def __init__(self):
+        self.retries = None
+        self.delay = None
+        self.backoff = None
+        self.on_timeout = False
+        self.exitcodes = None
+
+    def parse(self, key, value, name):
+        if key == self.KEY_RETRIES or key == self.KEY_DELAY:
+            if type(value) is not int or value < 0:
+                raise ParseException("teststep '%s': %s must be a positive "
+                                     "integer" % (name, key))
+            if key == self.KEY_RETRIES:
+                self.retries = value
+            else:
+                self.delay = value
+        elif key == self.KEY_BACKOFF:
+            if type(value) not in (int, float) or value < 1:
+                raise ParseException("teststep '%s': %s must be a number of "
+                                     "at least 1" % (name, key))
+            self.backoff = float(value)
+        elif key == self.KEY_ON:
+            if type(value) is not list:
+                value = [value]
+            self.exitcodes = set()
+            for item in value:
+                if item == self.ON_TIMEOUT:
+                    self.on_timeout = True
+                elif type(item) is int:
+                    self.exitcodes.add(item)
+                else:
+                    raise ParseException("teststep '%s': %s must be '%s', an "
+                                         "exit code or a list of them" %
+                                         (name, key, self.ON_TIMEOUT))
+
+    @property
+    def attempts(self):
+        retries = self.retries
+        if retries is None:
+            retries = self.default_retries
+        return retries + 1
+
+    def delay_after(self, result, attempt):
+        # Returns the delay in milliseconds before the next attempt or None
+        # if the failed attempt (counted from 1) isn't retried.
+        if attempt >= self.attempts:
+            return None
+        if self.exitcodes is not None:
+            if result.timed_out:
+                if not self.on_timeout:
+                    return None
+            elif result.exitcode not in self.exitcodes:
+                return None
+
+        delay = self.delay if self.delay is not None else self.default_delay
+        backoff = self.backoff if self.backoff is not None \
+            else self.default_backoff
+        return delay * backoff ** (attempt - 1)
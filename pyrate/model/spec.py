@@ -0,0 +1,182 @@
+#
+# Copyright (C) 2015 BMW Car IT GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import hashlib
+import os
+import pickle
+import sys
+
+import yaml
+
+import pyrate
+from pyrate.exception import ParseException
+from pyrate.model import env
+from pyrate.model.common import definition_digest
+from pyrate.model.fixture import Fixture
+from pyrate.model.testcase import TestCase
+from pyrate.model.teststep import TestStep
+
+# use libyaml if it is available
+Loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+
+class Spec:
+    # the parsed model of a test specification
+
+    def __init__(self, steps, cases, variables, sources=None,
+                 fixtures=None):
+        self.steps = steps
+        self.cases = cases
+        self.variables = variables
+        self.fixtures = fixtures if fixtures is not None else {}
+        # digest of the definition of a case -> the case
+        self.sources = sources if sources is not None else {}
+
+
+def parse_spec(testspec, previous=None):
+    # With the model of an earlier version of the specification only the
+    # test cases which changed are built again, the others are taken over.
+    steps = {}
+    fixtures = {}
+    cases = []
+    variables = {}
+    sources = {}
+    reusable = dict(previous.sources) if previous is not None else {}
+
+    if type(testspec) is not list or \
+            any(type(item) is not dict for item in testspec):
+        raise ParseException("test specification must be a list of items")
+
+    # first find all shared test steps
+    for item in testspec:
+        for key, value in item.items():
+            if key == TestStep.KEY:
+                new_step = TestStep(value)
+                steps[new_step.name] = new_step
+
+    # fixtures use shared steps, cases use fixtures
+    for item in testspec:
+        for key, value in item.items():
+            if key == Fixture.KEY:
+                new_fixture = Fixture(value, steps)
+                fixtures[new_fixture.name] = new_fixture
+
+    # a case has to be built again if any shared step or fixture changed
+    shared = definition_digest(None, *sorted(
+        [step.digest for step in steps.values()] +
+        [fixture.digest for fixture in fixtures.values()]))
+
+    # now we can parse all test cases
+    for item in testspec:
+        for key, value in item.items():
+            if key == TestCase.KEY:
+                source = definition_digest(value, shared)
+                new_case = reusable.pop(source, None)
+                if new_case is None:
+                    new_case = TestCase(value, steps, fixtures)
+                sources[source] = new_case
+                if new_case.matrix is not None:
+                    cases.extend(new_case.instances())
+                else:
+                    cases.append(new_case)
+            elif key in (TestStep.KEY, Fixture.KEY):
+                pass
+            elif key == env.KEY:
+                variables = env.parse_env(value)
+            else:
+                raise ParseException("unexpected token '%s'" % key)
+
+    return Spec(steps, cases, variables, sources, fixtures)
+
+
+def default_cache_dir():
+    base = os.environ.get('XDG_CACHE_HOME',
+                          os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'pyrate')
+
+
+def code_digest():
+    # the model classes are pickled, so a cache is only valid for the
+    # pyrate code which wrote it
+    digest = hashlib.sha256(('%s %s' % (pyrate.__version__,
+                                        sys.version)).encode('utf-8'))
+    root = os.path.dirname(os.path.abspath(pyrate.__file__))
+    for directory, dirnames, filenames in sorted(os.walk(root)):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.endswith('.py'):
+                stat = os.stat(os.path.join(directory, filename))
+                entry = '%s %d %d' % (filename, stat.st_size,
+                                      stat.st_mtime_ns)
+                digest.update(entry.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def load_spec(path, cache_dir=None, previous=None):
+    # Parses the test specification at path. With a cache directory the
+    # parsed model is stored keyed by the content of the file, so parsing
+    # an unchanged specification again just loads the model. The previous
+    # model is reused as described in parse_spec().
+    with open(path, 'rb') as spec_file:
+        content = spec_file.read()
+
+    cache_file = None
+    key = None
+    if cache_dir is not None:
+        key = hashlib.sha256(content).hexdigest() + code_digest()
+        name = hashlib.sha256(os.path.abspath(path).encode('utf-8'))
+        cache_file = os.path.join(cache_dir, 'spec',
+                                  name.hexdigest() + '.pickle')
+        spec = read_cache(cache_file, key)
+        if spec is not None:
+            return spec
+
+    spec = parse_spec(yaml.load(content, Loader=Loader), previous)
+
+    if cache_file is not None:
+        write_cache(cache_file, key, spec)
+
+    return spec
+
+
+def read_cache(cache_file, key):
+    # The key is a line of its own in front of the pickled model, only a
+    # model stored for the same specification and code is unpickled.
+    try:
+        expected = key.encode('ascii') + b'\n'
+        with open(cache_file, 'rb') as cache:
+            if cache.readline(len(expected)) != expected:
+                return None
+            return pickle.load(cache)
+    except Exception:
+        # missing, damaged or written by an incompatible version
+        return None
+
+
+def write_cache(cache_file, key, spec):
+    temporary = '%s.%d' % (cache_file, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        with open(temporary, 'wb') as cache:
+            cache.write(key.encode('ascii') + b'\n')
+            pickle.dump(spec, cache, pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, cache_file)
+    except (OSError, pickle.PicklingError):
+        # the cache is an optimization only
+        try:
+            os.unlink(temporary)
+        except OSError:
+            pass
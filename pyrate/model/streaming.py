@@ -0,0 +1,62 @@
+#
+# Copyright (C) 2015 BMW Car IT GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from pyrate.exception import ParseException
+
+
+class StreamingOptions:
+    KEY = 'streaming'
+    KEY_ABORT = 'abort'
+    KEY_TAIL = 'tail'
+    KEY_ANCHORS = 'anchors'
+
+    # '^' and '$' match at line boundaries
+    ANCHORS_LINE = 'line'
+    # '^' and '$' match at the start and end of the whole output like in a
+    # buffered step. This keeps the complete stream in memory.
+    ANCHORS_OUTPUT = 'output'
+
+    def __init__(self, yaml_tree):
+        self.abort = False
+        self.tail = 65536
+        self.anchors = self.ANCHORS_LINE
+
+        if type(yaml_tree) is bool:
+            return
+        if type(yaml_tree) is not dict:
+            raise ParseException("%s must be bool or dict" % self.KEY)
+
+        for key, value in yaml_tree.items():
+            if key == self.KEY_ABORT:
+                if type(value) is not bool:
+                    raise ParseException("%s: %s must be a bool" %
+                                         (self.KEY, self.KEY_ABORT))
+                self.abort = value
+            elif key == self.KEY_TAIL:
+                if type(value) is not int or value < 0:
+                    raise ParseException("%s: %s must be a positive integer" %
+                                         (self.KEY, self.KEY_TAIL))
+                self.tail = value
+            elif key == self.KEY_ANCHORS:
+                if value not in (self.ANCHORS_LINE, self.ANCHORS_OUTPUT):
+                    raise ParseException("%s: %s must be '%s' or '%s'" %
+                                         (self.KEY, self.KEY_ANCHORS,
+                                          self.ANCHORS_LINE,
+                                          self.ANCHORS_OUTPUT))
+                self.anchors = value
+            else:
+                raise ParseException("%s: unexpected token '%s'" %
+                                     (self.KEY, key))
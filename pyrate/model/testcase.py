@@ -18,10 +18,16 @@ import copy
 import datetime
 
 from pyrate.exception import ParseException
-from pyrate.model.common import needs_token
-from pyrate.model.teststep import TestStep
-from pyrate.output.terminal import STATUS_SEP
-from pyrate.util import duration
+from pyrate.model.common import definition_digest, needs_token
+from pyrate.model.env import parse_env
+from pyrate.model.graph import StepGraph
+from pyrate.model.matrix import Matrix
+from pyrate.model.teststep import StepInvocation, TestStep
+from pyrate.fixtures import fixtures
+from pyrate.output.reporter import reporters
+from pyrate.output.terminal import STATUS_FAILED, STATUS_SEP
+from pyrate.util import duration, resolveVariables, VariableCycleException
+from pyrate.util import VariableScope
 
 
 def create_step(yaml_tree, name, shared_steps):
@@ -31,27 +37,43 @@ def create_step(yaml_tree, name, shared_steps):
             raise ParseException(
                 "%s '%s': undefined reference to %s '%s'" %
                 (TestCase.KEY, name, TestStep.KEY, yaml_tree))
-        return shared_steps[yaml_tree]
+        return StepInvocation(shared_steps[yaml_tree])
     elif type(yaml_tree) is dict:
         for key, value in yaml_tree.items():
             if key != TestStep.KEY:
                 # check for a shared step with argument
                 if key in shared_steps:
-
-                    # The step has to be copied. Otherwise all instances of
-                    # this step would have the same set of arguments.
-                    step = copy.deepcopy(shared_steps[key])
-                    step.parse_args(value)
-                    return step
+                    return StepInvocation(shared_steps[key], parse_env(value))
 
                 raise ParseException("%s '%s': unexpected token '%s'" %
                                      (TestCase.KEY, name, key))
-            return TestStep(value)
+            return StepInvocation(TestStep(value))
     else:
         raise ParseException("%s '%s': unexpected type %s" %
                              (TestCase.KEY, name, type(yaml_tree)))
 
 
+def create_steps(yaml_tree, name, shared_steps):
+    # A reference to a shared step with a matrix is used once per
+    # combination of its arguments, all uses refer to the same step.
+    if type(yaml_tree) is dict and len(yaml_tree) == 1:
+        key, value = next(iter(yaml_tree.items()))
+        if key in shared_steps and type(value) is dict and \
+                Matrix.KEY in value:
+            arguments = dict(value)
+            matrix = Matrix(arguments.pop(Matrix.KEY),
+                            "%s '%s': step '%s'" % (TestCase.KEY, name, key))
+            arguments = parse_env(arguments)
+            steps = []
+            for values in matrix.combinations():
+                combined = dict(arguments)
+                combined.update(values)
+                steps.append(StepInvocation(shared_steps[key], combined,
+                                            Matrix.label(values)))
+            return steps
+    return [create_step(yaml_tree, name, shared_steps)]
+
+
 class TestCase:
 
     KEY = 'testcase'
@@ -59,14 +81,25 @@ class TestCase:
     KEY_STEPS = 'steps'
 
     KEY_FATAL = 'fatal'
+    KEY_MATRIX = Matrix.KEY
+    KEY_FIXTURES = 'fixtures'
 
-    def __init__(self, yaml_tree, shared_steps):
+    def __init__(self, yaml_tree, shared_steps, shared_fixtures=None):
         self.name = None
         self.steps = None
         self.fatal = False
+        self.matrix = None
+        self.fixtures = []
+        # values of the matrix variables of a case created by instances()
+        self.variables = {}
+        # whether reporters see the case, not for the steps of fixtures
+        self.reported = True
 
         self.failed = False
+        # the name of the fixture which failed to set up for the case
+        self.broken = None
         self.executed = False
+        self.duration = 0
 
         for key, value in yaml_tree.items():
             if key == self.KEY_NAME:
@@ -74,8 +107,8 @@ class TestCase:
             elif key == self.KEY_STEPS:
                 self.steps = []
                 for yamlStep in value:
-                    self.steps.append(create_step(yamlStep, self.name,
-                                                  shared_steps))
+                    self.steps.extend(create_steps(yamlStep, self.name,
+                                                   shared_steps))
             elif key == self.KEY_FATAL:
                 if type(value) is not bool:
                     raise ParseException("%s '%s': error parsing %s (%s) : "
@@ -85,27 +118,183 @@ class TestCase:
                                           self.KEY_FATAL,
                                           value))
                 self.fatal = value
+            elif key == self.KEY_MATRIX:
+                self.matrix = Matrix(value, "%s '%s'" % (self.KEY,
+                                                         yaml_tree.get(
+                                                             self.KEY_NAME)))
+            elif key == self.KEY_FIXTURES:
+                self.fixtures = self.parse_fixtures(yaml_tree.get(
+                    self.KEY_NAME), value, shared_fixtures or {})
             else:
                 raise ParseException("%s (%s): Unknown token '%s'" % (
                     self.KEY, self.name, key))
 
         needs_token(self.name, self.KEY, self.KEY_NAME, self.name)
         needs_token(self.steps, self.KEY, self.KEY_STEPS, self.name)
+        # the name of the case this one was repeated from
+        self.origin = self.name
+
+        # changes whenever the case or one of the steps it uses changes
+        self.digest = definition_digest(yaml_tree, *(
+            [step.step.digest for step in self.steps] +
+            [fixture.digest for fixture in self.fixtures]))
+
+        # only set if steps declare dependencies
+        self.graph = StepGraph.of(self.name, self.steps)
+
+    def parse_fixtures(self, name, value, shared_fixtures):
+        if type(value) is str:
+            value = [value]
+        if type(value) is not list or \
+                any(type(fixture) is not str for fixture in value):
+            raise ParseException("%s '%s': %s must be a list of names" %
+                                 (self.KEY, name, self.KEY_FIXTURES))
+        for fixture in value:
+            if fixture not in shared_fixtures:
+                raise ParseException(
+                    "%s '%s': undefined reference to fixture '%s'" %
+                    (self.KEY, name, fixture))
+        return [shared_fixtures[fixture] for fixture in value]
+
+    def instances(self):
+        # The cases of the matrix of this one, named after their
+        # combination. They are created without parsing anything again and
+        # share the step definitions, so only the invocations are per case.
+        for values in self.matrix.combinations():
+            case = copy.copy(self)
+            case.name = "%s %s" % (self.name, Matrix.label(values))
+            case.origin = case.name
+            case.matrix = None
+            case.variables = values
+            case.steps = [StepInvocation(step.step, step.arguments,
+                                         step.label)
+                          for step in self.steps]
+            case.digest = definition_digest(case.name, self.digest)
+            if self.graph is not None:
+                case.graph = self.graph.of_steps(case.steps)
+            yield case
 
-    def run(self, variables):
+    def scope(self, variables):
+        # the matrix variables take precedence over global ones
+        if not self.variables:
+            return variables
+        if not isinstance(variables, VariableScope):
+            variables = VariableScope(variables)
+        return variables.child(self.variables)
+
+    def inputs(self, variables):
+        # the resolved input patterns of all steps
+        patterns = []
+        variables = self.scope(variables)
+        for step in self.steps:
+            declared = list(step.step.inputs)
+            if step.step.cache is not None:
+                declared += step.step.cache.inputs
+            for pattern in declared:
+                try:
+                    patterns.append(resolveVariables(pattern,
+                                                     step.scope(variables)))
+                except VariableCycleException:
+                    pass
+        return patterns
+
+    def repeated(self, count):
+        # independent copies of the case which share the step definitions
+        copies = []
+        for number in range(1, count + 1):
+            shared = dict((id(step.step), step.step) for step in self.steps)
+            shared.update((id(fixture), fixture) for fixture in self.fixtures)
+            case = copy.deepcopy(self, shared)
+            case.name = "%s #%d" % (self.name, number)
+            copies.append(case)
+        return copies
+
+    def reset(self):
+        self.failed = False
+        self.broken = None
+        self.executed = False
+        self.duration = 0
+        for step in self.steps:
+            step.reset()
+
+    def run(self, variables, cancel=None):
+        # the fixtures are torn down whatever happens to the steps
+        lease = fixtures.acquire(self, variables)
+        try:
+            start = self.begin()
+            if lease.failed is not None:
+                self.fixture_failed(lease.failed)
+                return self.end(start)
+
+            variables = self.scope(lease.variables)
+            if self.graph is not None:
+                self.graph.run(self, variables, cancel)
+                return self.end(start)
+
+            for step in self.steps:
+                if cancel is not None and cancel.cancelled:
+                    break
+
+                # run returns false if a fatal test step failed
+                if not step.run(self, variables, cancel):
+                    break
+
+            return self.end(start)
+        finally:
+            fixtures.release(self, lease)
+
+    async def run_async(self, variables, engine, cancel=None):
+        lease = await fixtures.acquire_async(self, variables)
+        try:
+            start = self.begin()
+            if lease.failed is not None:
+                self.fixture_failed(lease.failed)
+                return self.end(start)
+
+            variables = self.scope(lease.variables)
+            if self.graph is not None:
+                await self.graph.run_async(self, variables, engine, cancel)
+                return self.end(start)
+
+            for step in self.steps:
+                if cancel is not None and cancel.cancelled:
+                    break
+
+                if not await step.run_async(self, variables, engine, cancel):
+                    break
+
+            return self.end(start)
+        finally:
+            await fixtures.release_async(self, lease)
+
+    def fixture_failed(self, name):
+        # none of the steps runs, the case counts as one failed test
+        self.broken = name
+        print("%s %s: fixture '%s' failed" % (STATUS_FAILED, self.name, name))
+
+    def begin(self):
         self.executed = True
-        start = datetime.datetime.now()
         print("%s %s" % (STATUS_SEP, self.name))
+        if self.reported:
+            reporters.case_started(self)
+        return datetime.datetime.now()
 
-        for step in self.steps:
-            # run returns false if a fatal test step failed
-            if not step.run(self, variables):
-                break
+    def end(self, start):
+        elapsed = duration(start)
+        self.duration = elapsed
 
+        if self.graph is not None:
+            path, total = self.graph.critical_path()
+            if path:
+                print("%s %s : critical path %s (%d ms)" %
+                      (STATUS_SEP, self.name,
+                       ' -> '.join(step.name for step in path), total))
         print("%s %s : %d tests (%d ms total)\n" %
-              (STATUS_SEP, self.name, len(self.steps), duration(start)))
+              (STATUS_SEP, self.name, len(self.steps), elapsed))
 
         # check if fatal and at least one failure
         failed = [step for step in self.steps if step.failed]
-        self.failed = len(failed)
+        self.failed = len(failed) + (1 if self.broken is not None else 0)
+        if self.reported:
+            reporters.case_finished(self, elapsed)
         return not (self.failed > 0 and self.fatal)
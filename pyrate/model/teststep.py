@@ -14,25 +14,73 @@
 # limitations under the License.
 #
 
-import datetime
-import os
-import signal
-from threading import Thread
+import asyncio
 import time
 from subprocess import Popen, PIPE
 
-import psutil
-
+from pyrate.capture import BufferSink, LineSink, capture
 from pyrate.exception import ParseException
-from pyrate.model.common import needs_token
-from pyrate.output.terminal import STATUS_RUN, STATUS_OK, STATUS_FAILED
-from pyrate.util import duration, resolveVariables
+from pyrate.model.common import definition_digest, needs_token
+from pyrate.process import TreeMonitor, max_rss, reap, timeouts, \
+    wait_exited
+from pyrate.output.reporter import reporters
+from pyrate.result_cache import result_cache
+from pyrate.shell_pool import shell_pool
+from pyrate.output.terminal import STATUS_RUN, STATUS_OK, STATUS_FAILED, \
+    STATUS_CACHED, STATUS_RETRY
+from pyrate.util import elapsed, resolveVariables
+from pyrate.util import VariableCycleException, VariableScope
 from pyrate.validator.exitcode import ExitCodeValidator
+from pyrate.validator.resources import ResourceValidator
 from pyrate.validator.stream import StreamValidator
-from pyrate.model.env import parse_env
+from pyrate.model.caching import CacheOptions
+from pyrate.model.repeat import RepeatOptions
+from pyrate.model.retry import RetryPolicy
+from pyrate.model.streaming import StreamingOptions
+
+
+# characters of a spilled stream which are kept in the result
+EXCERPT_SIZE = 65536
+
+
+class StepResult:
+    # the outcome of executing a test step
+
+    __slots__ = ('success', 'exitcode', 'timed_out', 'aborted', 'cached',
+                 'attempts', 'stdout', 'stderr', 'duration', 'spawn', 'wall',
+                 'cpu_user', 'cpu_sys', 'max_rss', 'children', 'resolve',
+                 'validate', 'failure')
+
+    def __init__(self):
+        self.success = True
+        self.exitcode = None
+        self.timed_out = False
+        self.aborted = False
+        self.cached = False
+        self.attempts = 1
+        self.stdout = ''
+        self.stderr = ''
+        # why the first failed validator failed, for reports
+        self.failure = None
+
+        # all times in milliseconds, max_rss in KiB, children is the peak
+        # number of processes below the shell if the step is monitored
+        self.duration = 0
+        self.spawn = 0
+        self.wall = 0
+        self.cpu_user = 0
+        self.cpu_sys = 0
+        self.max_rss = 0
+        self.children = 0
+        self.resolve = 0
+        self.validate = 0
 
 
 class TestStep:
+    # A parsed step definition. It is a template which isn't modified after
+    # parsing, all per run state lives in the StepInvocation objects which
+    # refer to it.
+
     KEY = 'teststep'
     KEY_NAME = 'name'
     KEY_MESSAGE = 'message'
@@ -42,6 +90,19 @@ class TestStep:
     KEY_STDERR = 'stderr'
     KEY_FATAL = 'fatal'
     KEY_TIMEOUT = 'timeout'
+    KEY_GRACE = 'grace'
+    KEY_STREAMING = StreamingOptions.KEY
+    KEY_SHELL = 'shell'
+    KEY_CACHE = CacheOptions.KEY
+    KEY_REPEAT = RepeatOptions.KEY
+    KEY_INPUTS = 'inputs'
+    KEY_NEEDS = 'needs'
+    KEY_AFTER = 'after'
+
+    # a new /bin/sh for every execution
+    SHELL_FRESH = 'fresh'
+    # a subshell of a long-lived shell from the shell pool
+    SHELL_PERSISTENT = 'persistent'
 
     def __init__(self, yaml_tree):
         # default values
@@ -50,13 +111,20 @@ class TestStep:
         self.command = None
         self.fatal = False
         self.timeout = 0
+        self.grace = 0
+        self.streaming = None
+        self.shell = None
+        self.cache = None
+        self.repeat = None
+        # names of the steps of the test case this step depends on, None if
+        # not declared
+        self.needs = None
+        self.after = None
+        self.retry = RetryPolicy()
+        # files (or glob patterns) the step reads besides its command
+        self.inputs = []
         self.validators = []
 
-        self.failed = False
-        self.abort_timeout = False
-        self.executed = False
-        self.arguments = {}
-
         for key, value in yaml_tree.items():
             if key == self.KEY_NAME:
                 self.name = value
@@ -70,6 +138,10 @@ class TestStep:
                 self.validators.append(StreamValidator(value, 'stdout'))
             elif key == self.KEY_STDERR:
                 self.validators.append(StreamValidator(value, 'stderr'))
+            elif key in ResourceValidator.KEYS:
+                self.validators.append(ResourceValidator(key, value))
+            elif key == self.KEY_REPEAT:
+                self.repeat = RepeatOptions(value)
             elif key == self.KEY_FATAL:
                 if type(value) is not bool:
                     raise ParseException("%s '%s': error parsing %s (%s) : "
@@ -86,6 +158,54 @@ class TestStep:
                                          (self.KEY, self.name,
                                           self.KEY_TIMEOUT, value))
                 self.timeout = yaml_tree[self.KEY_TIMEOUT]
+            elif key == self.KEY_GRACE:
+                if type(value) is not int:
+                    raise ParseException("%s '%s': error parsing %s (%s) : "
+                                         "must be an integer" %
+                                         (self.KEY, self.name,
+                                          self.KEY_GRACE, value))
+                self.grace = value
+            elif key == self.KEY_STREAMING:
+                if value is not False:
+                    self.streaming = StreamingOptions(value)
+            elif key == self.KEY_SHELL:
+                if value not in (self.SHELL_FRESH, self.SHELL_PERSISTENT):
+                    raise ParseException("%s '%s': error parsing %s (%s) : "
+                                         "must be '%s' or '%s'" %
+                                         (self.KEY, self.name,
+                                          self.KEY_SHELL, value,
+                                          self.SHELL_FRESH,
+                                          self.SHELL_PERSISTENT))
+                self.shell = value
+            elif key in (self.KEY_NEEDS, self.KEY_AFTER):
+                if type(value) is str:
+                    value = [value]
+                if type(value) is not list or \
+                        any(type(item) is not str for item in value):
+                    raise ParseException("%s '%s': error parsing %s (%s) : "
+                                         "must be a string or a list of "
+                                         "strings" %
+                                         (self.KEY, self.name, key, value))
+                if key == self.KEY_NEEDS:
+                    self.needs = value
+                else:
+                    self.after = value
+            elif key == self.KEY_INPUTS:
+                if type(value) is str:
+                    value = [value]
+                if type(value) is not list or \
+                        any(type(item) is not str for item in value):
+                    raise ParseException("%s '%s': error parsing %s (%s) : "
+                                         "must be a string or a list of "
+                                         "strings" %
+                                         (self.KEY, self.name,
+                                          self.KEY_INPUTS, value))
+                self.inputs = value
+            elif key in RetryPolicy.KEYS:
+                self.retry.parse(key, value, self.name)
+            elif key == self.KEY_CACHE:
+                if value is not False:
+                    self.cache = CacheOptions(value)
             else:
                 raise ParseException("%s (%s): Unknown token '%s'" % (
                     self.KEY, self.name, key))
@@ -93,91 +213,410 @@ class TestStep:
         # validate mandatory fields
         needs_token(self.name, self.KEY, self.KEY_NAME, self.name)
         needs_token(self.command, self.KEY, self.KEY_COMMAND, self.name)
+        self.digest = definition_digest(yaml_tree)
 
-    def parse_args(self, yaml_tree):
-        self.arguments = parse_env(yaml_tree)
+        # limits of a repeated step apply to the statistic over all runs,
+        # anything besides the duration needs the process tree to be watched
+        self.monitored = False
+        for validator in self.validators:
+            if isinstance(validator, ResourceValidator):
+                validator.repeat = self.repeat
+                if validator.key != ResourceValidator.KEY_DURATION:
+                    self.monitored = True
 
-    def process_timeout(self, process):
-        try:
-            start = datetime.datetime.now()
+        # a streaming step only keeps the tail of its output, which can't be
+        # validated again
+        if self.cache is not None and self.streaming is not None:
+            raise ParseException("%s '%s': %s can't be used with %s" %
+                                 (self.KEY, self.name, self.KEY_CACHE,
+                                  self.KEY_STREAMING))
 
-            while duration(start) < self.timeout:
-                # when abort is signaled there is no need to kill
-                # anything anymore
-                if self.abort_timeout:
-                    return
+    def persistent(self):
+        if self.shell is None:
+            return shell_pool.default
+        return self.shell == self.SHELL_PERSISTENT
 
-                time.sleep(0.001)
+    def spawn(self, execution, cancel):
+        result = StepResult()
+        if self.persistent():
+            return shell_pool.run(self, execution, cancel, result)
 
-            parent = psutil.Process(process.pid)
-            for child in parent.children(recursive=True):
-                os.kill(child.pid, signal.SIGKILL)
-                os.kill(parent.pid, signal.SIGKILL)
-        except:
-            pass
+        start = time.perf_counter()
+        process = Popen(execution.command, stdout=PIPE, stderr=PIPE,
+                        shell=True)
+        result.spawn = elapsed(start)
 
-    def execute(self, variables):
-        command = resolveVariables(self.command, variables)
+        if cancel is not None:
+            cancel.register(process)
 
-        process = Popen(command, stdout=PIPE, stderr=PIPE, shell=True)
+        monitor = None
+        if self.monitored:
+            monitor = TreeMonitor(process.pid).start()
 
-        # if a timeout was specified start a thread which kills the process
-        # tree if it's still running after the timeout
-        kill_thread = None
+        # if a timeout was specified the process tree gets killed by the
+        # shared timeout scheduler if it's still running after the timeout
+        timeout = None
         if self.timeout > 0:
-            self.abort_timeout = False
-            kill_thread = Thread(target=self.process_timeout, args=(process,))
-            kill_thread.start()
+            timeout = timeouts.schedule(process, self.timeout, self.grace)
 
-        stdout, stderr = process.communicate()
-        exitcode = process.wait()
+        result.aborted = capture(process, execution.sinks['stdout'],
+                                 execution.sinks['stderr'], execution.abort)
+        wait_exited(process)
+        if monitor is not None:
+            monitor.stop()
 
-        # if the timeout thread is still there we have to stop it
-        if kill_thread is not None:
-            self.abort_timeout = True
-            kill_thread.join()
+        if timeout is not None:
+            timeouts.cancel(timeout)
+            result.timed_out = timeout.expired
+        if cancel is not None:
+            cancel.unregister(process)
 
-        success = True
-        for validator in self.validators:
-            if not validator.validate(exitcode,
-                                      stdout.decode("utf-8"),
-                                      stderr.decode("utf-8"),
-                                      variables,
-                                      command):
-                success = False
+        result.exitcode, rusage = reap(process)
+        result.wall = elapsed(start)
+        if rusage is not None:
+            result.cpu_user = rusage.ru_utime * 1000
+            result.cpu_sys = rusage.ru_stime * 1000
+            result.max_rss = max_rss(rusage)
+        if monitor is not None:
+            monitor.record(result, rusage)
+
+        return result
+
+    def execute(self, variables, cancel=None):
+        execution = Execution(self, variables)
+        result = execution.cached()
+        if result is None:
+            result = execution.validate(self.spawn(execution, cancel))
+            if self.repeat is not None:
+                results = [result]
+                while results[-1].success and \
+                        len(results) < self.repeat.count:
+                    again = Execution(self, variables)
+                    results.append(again.validate(self.spawn(again, cancel)))
+                result = execution.limit(results)
+            if cancel is not None and cancel.cancelled:
+                # killed because a fatal case failed, not by its own doing
+                result.success = False
+                result.failure = 'cancelled'
+            execution.remember(result)
+        return result
+
+
+class Execution:
+    # One execution of a test step: the resolved command, the sinks its
+    # output goes to and the validation of the result. The process itself
+    # is run by TestStep.spawn() or by another engine.
+
+    def __init__(self, step, variables):
+        start = time.perf_counter()
+
+        self.step = step
+        self.variables = variables
+        self.command = resolveVariables(step.command, variables)
+        self.states = {}
+        self.abort = None
+        self.validation = 0.0
+        self.key = None
+        self.spilled = False
+
+        options = step.streaming
+        if options is None:
+            self.sinks = {'stdout': BufferSink(), 'stderr': BufferSink()}
+            self.resolve = elapsed(start)
+            return
+
+        for validator in step.validators:
+            if isinstance(validator, StreamValidator):
+                self.states[validator] = validator.start(variables,
+                                                         options.anchors)
+
+        self.sinks = {}
+        for name in ('stdout', 'stderr'):
+            consumer = None
+            for validator, state in self.states.items():
+                if validator.stream == name:
+                    consumer = self.timed(state.feed)
+            self.sinks[name] = LineSink(consumer, options.tail)
+
+        if options.abort:
+            self.abort = self.decided
+
+        self.resolve = elapsed(start)
+
+    def cached(self):
+        # Returns the result of an earlier execution, validated again, if
+        # the step is cacheable and nothing it depends on changed.
+        if self.step.cache is None or not result_cache.enabled:
+            return None
+
+        start = time.perf_counter()
+        self.key = result_cache.key(self)
+        record = result_cache.load(self.key)
+        self.resolve += elapsed(start)
+        if record is None:
+            return None
+
+        result = StepResult()
+        result.cached = True
+        result.exitcode = record['exitcode']
+        for name in ('stdout', 'stderr'):
+            self.sinks[name].feed(record[name].encode('utf-8'))
+            self.sinks[name].close()
+        return self.validate(result)
+
+    def remember(self, result):
+        # only passed results are cached, failures are always run again and
+        # spilled output is too large to be kept
+        if self.key is not None and result.success and not self.spilled and \
+                not result.timed_out and not result.aborted:
+            result_cache.store(self.key, result)
+
+    def timed(self, feed):
+        def consumer(block):
+            start = time.perf_counter()
+            feed(block)
+            self.validation += elapsed(start)
+        return consumer
+
+    def decided(self):
+        # the result is known once a stream check failed or, if there is no
+        # exit status to wait for, once all stream checks passed
+        results = [state.decided() for state in self.states.values()]
+        if False in results:
+            return True
+        waits_for_exit = len(self.states) < len(self.step.validators)
+        return not waits_for_exit and None not in results
+
+    def validate(self, result):
+        try:
+            return self.check(result)
+        finally:
+            if self.step.streaming is None:
+                for sink in self.sinks.values():
+                    sink.release()
+
+    def check(self, result):
+        command = self.command
+
+        # the streams the validators look at, spilled streams are searched
+        # in the file and only an excerpt goes into the result
+        streams = {}
+        for name, sink in self.sinks.items():
+            if self.step.streaming is not None:
+                streams[name] = sink.getvalue()
+                text = streams[name]
+            elif sink.spilled:
+                self.spilled = True
+                streams[name] = sink.view()
+                text = sink.excerpt(EXCERPT_SIZE)
+            else:
+                streams[name] = sink.getvalue().decode("utf-8")
+                text = streams[name]
+
+            if name == 'stdout':
+                result.stdout = text
+            else:
+                result.stderr = text
+        result.resolve = self.resolve
+
+        start = time.perf_counter()
+        for validator in self.step.validators:
+            if isinstance(validator, ResourceValidator) and \
+                    (result.cached or self.step.repeat is not None):
+                # nothing was measured or the limits apply to all runs
+                continue
+            if validator in self.states:
+                state = self.states[validator]
+                state.finish()
+                valid = state.report(self.sinks[validator.stream].getvalue(),
+                                     command)
+            elif result.aborted:
+                # the exit status is the one of the kill
+                continue
+            else:
+                valid = validator.validate(result.exitcode,
+                                           streams['stdout'],
+                                           streams['stderr'],
+                                           self.variables,
+                                           command, result)
+            if not valid:
+                result.success = False
+                if result.failure is None:
+                    result.failure = validator.failure(result)
 
                 # don't print command on further validators
                 command = None
+        result.validate = self.validation + elapsed(start)
 
-        return success
+        return result
 
-    def run(self, testcase, variables):
-        self.executed = True
-        start = datetime.datetime.now()
+    def limit(self, results):
+        # The runs of a repeated step are done, every one validated on its
+        # own. The first result gets the statistic of the measurements of
+        # all runs and is checked against the resource limits.
+        result = results[0]
+        failed = [run for run in results if not run.success]
+        if failed:
+            result.success = False
+            result.failure = failed[0].failure
+            return result
+
+        for field in ('wall', 'cpu_user', 'cpu_sys', 'max_rss', 'children'):
+            setattr(result, field, self.step.repeat.aggregate(
+                [getattr(run, field) for run in results]))
+
+        command = self.command
+        for validator in self.step.validators:
+            if isinstance(validator, ResourceValidator) and \
+                    not validator.validate(result.exitcode, None, None,
+                                           self.variables, command, result):
+                result.success = False
+                if result.failure is None:
+                    result.failure = validator.failure(result)
+                command = None
+        return result
+
+
+class StepInvocation:
+    # The use of a test step within a test case, holding the arguments and
+    # the result of this use. Shared steps are referenced, not copied.
 
-        # merge global and step variables
-        # step variables take precedence
-        used_variables = {}
-        for key, value in variables.items():
-            used_variables[key] = value
-        for key, value in self.arguments.items():
-            used_variables[key] = value
+    __slots__ = ('step', 'arguments', 'label', 'failed', 'executed',
+                 'duration', 'cached_scope')
 
+    def __init__(self, step, arguments=None, label=None):
+        self.step = step
+        self.arguments = arguments if arguments is not None else {}
+        # distinguishes the uses of a shared step with a matrix
+        self.label = label
+        self.failed = False
+        self.executed = False
+        self.duration = 0
+        self.cached_scope = None
 
-        description = self.message
+    @property
+    def name(self):
+        return self.step.name
+
+    @property
+    def fatal(self):
+        return self.step.fatal
+
+    def reset(self):
+        self.failed = False
+        self.executed = False
+        self.duration = 0
+
+    def scope(self, variables):
+        if not isinstance(variables, VariableScope):
+            variables = VariableScope(variables)
+
+        # the scope of the arguments is kept as long as the global
+        # variables stay the same, so resolved values are reused
+        scope = self.cached_scope
+        if scope is None or scope.parent is not variables:
+            scope = variables.child(self.arguments)
+            self.cached_scope = scope
+        return scope
+
+    def run(self, testcase, variables, cancel=None):
+        start = time.perf_counter()
+        prepared = self.prepare(testcase, variables, start)
+        if prepared is None:
+            return not self.fatal
+
+        used_variables, description = prepared
+        attempt = 1
+        while True:
+            result = self.step.execute(used_variables, cancel)
+            delay = self.retry_delay(testcase, description, result, attempt,
+                                     cancel)
+            if delay is None:
+                break
+            time.sleep(delay / 1000.0)
+            attempt += 1
+
+        result.attempts = attempt
+        return self.finish(testcase, description, result, start)
+
+    async def run_async(self, testcase, variables, engine, cancel=None):
+        start = time.perf_counter()
+        prepared = self.prepare(testcase, variables, start)
+        if prepared is None:
+            return not self.fatal
+
+        used_variables, description = prepared
+        attempt = 1
+        while True:
+            result = await engine.execute(self.step, used_variables, cancel)
+            delay = self.retry_delay(testcase, description, result, attempt,
+                                     cancel)
+            if delay is None:
+                break
+            await asyncio.sleep(delay / 1000.0)
+            attempt += 1
+
+        result.attempts = attempt
+        return self.finish(testcase, description, result, start)
+
+    def retry_delay(self, testcase, description, result, attempt, cancel):
+        # returns the delay before the next attempt or None if the result is
+        # final
+        if result.success or (cancel is not None and cancel.cancelled):
+            return None
+        delay = self.step.retry.delay_after(result, attempt)
+        if delay is not None:
+            print("%s %s: %s (attempt %d of %d failed, retry in %d ms)" %
+                  (STATUS_RETRY, testcase.name, description, attempt,
+                   self.step.retry.attempts, delay))
+        return delay
+
+    def prepare(self, testcase, variables, start):
+        # returns the variables and description of the step or None if the
+        # variables can't be resolved
+        self.executed = True
+
+        description = self.step.message
         if description is None:
-            description = self.name
+            description = self.step.name
 
-        description = resolveVariables(description, used_variables)
+        try:
+            # step variables take precedence over global ones
+            used_variables = self.scope(variables)
+            used_variables.check()
+            description = resolveVariables(description, used_variables)
+            if self.label is not None:
+                description = "%s %s" % (description, self.label)
+        except VariableCycleException as e:
+            print("%s %s: %s: %s" % (STATUS_FAILED, testcase.name,
+                                     self.name, e.message))
+            self.failed = True
+            result = StepResult()
+            result.success = False
+            result.failure = e.message
+            result.duration = elapsed(start)
+            if testcase.reported:
+                reporters.step_finished(testcase, self, self.name, result)
+            return None
 
         print("%s %s: %s" % (STATUS_RUN, testcase.name, description))
+        return used_variables, description
+
+    def finish(self, testcase, description, result, start):
+        result.duration = elapsed(start)
+        self.duration = result.duration
 
-        status = STATUS_OK
-        if not self.execute(used_variables):
+        status = STATUS_CACHED if result.cached else STATUS_OK
+        if not result.success:
             status = STATUS_FAILED
             self.failed = True
 
-        print("%s %s: %s (%d ms)" %
-              (status, testcase.name, description, duration(start)))
+        attempts = ''
+        if result.attempts > 1:
+            attempts = ', %d attempts' % result.attempts
+        print("%s %s: %s (%d ms%s)" %
+              (status, testcase.name, description, result.duration, attempts))
+        if testcase.reported:
+            reporters.step_finished(testcase, self, description, result)
 
         return not (self.failed and self.fatal)
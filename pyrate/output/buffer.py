@@ -0,0 +1,86 @@
+#
+# Copyright (C) 2015 BMW Car IT GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import contextvars
+import threading
+
+
+class ThreadOutput:
+    # Replacement for sys.stdout which collects everything a thread or an
+    # asyncio task prints between begin() and end(). end() hands the
+    # collected text back so the caller decides when to emit() it. Threads
+    # and tasks which are not capturing write through to the underlying
+    # stream.
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.buffer = contextvars.ContextVar('pyrate_output', default=None)
+        self.lock = threading.Lock()
+
+    def begin(self):
+        self.buffer.set([])
+
+    def end(self):
+        buffer = self.buffer.get()
+        self.buffer.set(None)
+        return ''.join(buffer or [])
+
+    def emit(self, text):
+        with self.lock:
+            self.stream.write(text)
+            self.stream.flush()
+
+    def write(self, data):
+        buffer = self.buffer.get()
+        if buffer is not None:
+            buffer.append(data)
+            return len(data)
+
+        with self.lock:
+            return self.stream.write(data)
+
+    def flush(self):
+        if self.buffer.get() is None:
+            with self.lock:
+                self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    def capture(self, function, *args):
+        # Runs function with its output collected and passes the output on
+        # as a whole to the enclosing capture or to the stream, so the
+        # output of functions running side by side doesn't get mixed.
+        parent = self.buffer.get()
+        self.begin()
+        try:
+            return function(*args)
+        finally:
+            self.forward(parent, self.end())
+
+    async def capture_async(self, function, *args):
+        parent = self.buffer.get()
+        self.begin()
+        try:
+            return await function(*args)
+        finally:
+            self.forward(parent, self.end())
+
+    def forward(self, parent, text):
+        if parent is not None:
+            parent.append(text)
+        else:
+            self.emit(text)
@@ -0,0 +1,63 @@
+#
+# Copyright (C) 2015 BMW Car IT GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import statistics
+import threading
+
+from pyrate.output.reporter import Reporter
+from pyrate.output.terminal import STATUS_STATS
+
+
+class FlakinessReporter(Reporter):
+    # Counts the attempts and failures of every step over all runs of its
+    # test case and prints them at the end: for steps which needed more
+    # than one attempt or, with 'everything' set (e.g. when cases are
+    # repeated), for all steps. The flakiness is the share of attempts
+    # which failed.
+
+    def __init__(self, everything=False):
+        self.everything = everything
+        self.lock = threading.Lock()
+        self.steps = {}
+
+    def step_finished(self, testcase, step, description, result):
+        key = (testcase.origin, step.name)
+        with self.lock:
+            if key not in self.steps:
+                self.steps[key] = {'runs': 0, 'passed': 0, 'attempts': 0,
+                                   'durations': []}
+            entry = self.steps[key]
+            entry['runs'] += 1
+            entry['passed'] += 1 if result.success else 0
+            entry['attempts'] += result.attempts
+            entry['durations'].append(result.duration)
+
+    def finish(self, duration):
+        for (case, step), entry in self.steps.items():
+            if entry['attempts'] == entry['runs'] and not self.everything:
+                continue
+
+            failed = entry['attempts'] - entry['passed']
+            durations = entry['durations']
+            deviation = 0
+            if len(durations) > 1:
+                deviation = statistics.stdev(durations)
+            print("%s %s: %s: %d runs, %d passed, %d attempts, flakiness "
+                  "%.1f%%, %d ms +- %d ms (%d to %d ms)" %
+                  (STATUS_STATS, case, step, entry['runs'], entry['passed'],
+                   entry['attempts'], 100.0 * failed / entry['attempts'],
+                   statistics.mean(durations), deviation, min(durations),
+                   max(durations)))
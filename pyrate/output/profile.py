@@ -0,0 +1,98 @@
+#
+# Copyright (C) 2015 BMW Car IT GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import heapq
+import threading
+
+from pyrate.output.reporter import Reporter
+from pyrate.output.terminal import STATUS_PROFILE
+
+
+class ProfileReporter(Reporter):
+    # Collects the timings of all steps and prints the slowest steps and
+    # cases and where the time went at the end of the run. Only the 'count'
+    # slowest entries are kept, the rest is aggregated.
+
+    def __init__(self, count=10):
+        self.count = count
+        self.lock = threading.Lock()
+        self.steps = []
+        self.cases = []
+        self.sequence = 0
+
+        self.total = {'duration': 0.0, 'wall': 0.0, 'spawn': 0.0,
+                      'resolve': 0.0, 'validate': 0.0, 'cpu_user': 0.0,
+                      'cpu_sys': 0.0}
+        self.max_rss = 0
+        self.executed = 0
+
+    def keep(self, heap, duration, text):
+        # bounded min heap of the slowest entries, '--profile 0' only
+        # prints the totals
+        if self.count <= 0:
+            return
+        self.sequence += 1
+        entry = (duration, self.sequence, text)
+        if len(heap) < self.count:
+            heapq.heappush(heap, entry)
+        elif entry > heap[0]:
+            heapq.heapreplace(heap, entry)
+
+    def step_finished(self, testcase, step, description, result):
+        with self.lock:
+            self.executed += 1
+            for key in self.total:
+                self.total[key] += getattr(result, key)
+            self.max_rss = max(self.max_rss, result.max_rss)
+            self.keep(self.steps, result.duration,
+                      "%s: %s" % (testcase.name, description))
+
+    def case_finished(self, testcase, duration):
+        with self.lock:
+            self.keep(self.cases, duration, testcase.name)
+
+    def finish(self, duration):
+        total = self.total
+        pyrate = total['duration'] - total['wall']
+        # streaming steps validate while the command runs, so validation
+        # may overlap with the command time
+        other = max(0, pyrate - total['resolve'] - total['validate'])
+
+        lines = []
+        if self.count > 0:
+            lines.append("slowest steps:")
+            for step_duration, _, text in sorted(self.steps, reverse=True):
+                lines.append("  %8d ms  %s" % (step_duration, text))
+
+            lines.append("slowest test cases:")
+            for case_duration, _, text in sorted(self.cases, reverse=True):
+                lines.append("  %8d ms  %s" % (case_duration, text))
+
+        lines += [
+            "%d steps, %d ms total run time, %d ms in steps:" %
+            (self.executed, duration, total['duration']),
+            "  %8d ms  commands (cpu %d ms user, %d ms sys, "
+            "peak rss %d KiB)" % (total['wall'], total['cpu_user'],
+                                  total['cpu_sys'], self.max_rss),
+            "  %8d ms    spawning processes" % total['spawn'],
+            "  %8d ms  pyrate" % pyrate,
+            "  %8d ms    variable resolution" % total['resolve'],
+            "  %8d ms    validation" % total['validate'],
+            "  %8d ms    other" % other,
+        ]
+
+        for line in lines:
+            print("%s %s" % (STATUS_PROFILE, line))
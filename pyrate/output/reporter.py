@@ -0,0 +1,254 @@
+#
+# Copyright (C) 2015 BMW Car IT GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import contextvars
+import datetime
+import json
+import re
+import threading
+from xml.sax.saxutils import escape, quoteattr
+
+# characters of stdout/stderr which are kept per step in reports
+OUTPUT_LIMIT = 4096
+
+
+def truncate(text, limit=OUTPUT_LIMIT):
+    # keep the end of the output, that's where failures usually show up
+    if text is None or len(text) <= limit:
+        return text
+    return "[... %d characters omitted ...]\n%s" % (len(text) - limit,
+                                                   text[len(text) - limit:])
+
+
+# characters which must not appear in XML 1.0 documents
+XML_INVALID = re.compile('[^\u0009\u000a\u000d\u0020-\ud7ff\ue000-\ufffd'
+                         '\U00010000-\U0010ffff]')
+
+
+def xml_text(text):
+    return escape(XML_INVALID.sub('?', truncate(text)))
+
+
+class Reporter:
+    # Base class of result writers. Reporters are called from the threads
+    # running the test cases, so they have to lock their output.
+
+    def start(self):
+        pass
+
+    def case_started(self, testcase):
+        pass
+
+    def step_finished(self, testcase, step, description, result):
+        pass
+
+    def case_finished(self, testcase, duration):
+        pass
+
+    def finish(self, duration):
+        pass
+
+
+class ReporterList(Reporter):
+    # Dispatches all events to the registered reporters. Between hold() and
+    # release() the case events of a thread or an asyncio task are kept
+    # back instead, so a parallel run can drop the events of cases which a
+    # serial run wouldn't have executed and replay() the others.
+
+    def __init__(self):
+        self.reporters = []
+        self.held = contextvars.ContextVar('pyrate_events', default=None)
+
+    def add(self, reporter):
+        self.reporters.append(reporter)
+
+    def clear(self):
+        self.reporters = []
+
+    def hold(self):
+        self.held.set([])
+
+    def release(self):
+        events = self.held.get()
+        self.held.set(None)
+        return events or []
+
+    def replay(self, events):
+        for name, arguments in events:
+            getattr(self, name)(*arguments)
+
+    def defer(self, name, *arguments):
+        events = self.held.get()
+        if events is None:
+            return False
+        events.append((name, arguments))
+        return True
+
+    def start(self):
+        for reporter in self.reporters:
+            reporter.start()
+
+    def case_started(self, testcase):
+        if self.defer('case_started', testcase):
+            return
+        for reporter in self.reporters:
+            reporter.case_started(testcase)
+
+    def step_finished(self, testcase, step, description, result):
+        if self.defer('step_finished', testcase, step, description, result):
+            return
+        for reporter in self.reporters:
+            reporter.step_finished(testcase, step, description, result)
+
+    def case_finished(self, testcase, duration):
+        if self.defer('case_finished', testcase, duration):
+            return
+        for reporter in self.reporters:
+            reporter.case_finished(testcase, duration)
+
+    def finish(self, duration):
+        for reporter in self.reporters:
+            reporter.finish(duration)
+
+
+reporters = ReporterList()
+
+
+class JsonLinesReporter(Reporter):
+    # writes one JSON object per finished step and test case
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.lock = threading.Lock()
+
+    def write(self, record):
+        record['time'] = datetime.datetime.now().isoformat()
+        line = json.dumps(record, sort_keys=True) + '\n'
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+
+    def start(self):
+        self.file = open(self.path, 'w')
+
+    def step_finished(self, testcase, step, description, result):
+        self.write({'type': 'step',
+                    'case': testcase.name,
+                    'step': step.name,
+                    'description': description,
+                    'passed': result.success,
+                    'duration': result.duration,
+                    'exitcode': result.exitcode,
+                    'timeout': result.timed_out,
+                    'failure': result.failure,
+                    'cached': result.cached,
+                    'attempts': result.attempts,
+                    'spawn': result.spawn,
+                    'wall': result.wall,
+                    'cpu_user': result.cpu_user,
+                    'cpu_sys': result.cpu_sys,
+                    'max_rss': result.max_rss,
+                    'children': result.children,
+                    'resolve': result.resolve,
+                    'validate': result.validate,
+                    'stdout': truncate(result.stdout),
+                    'stderr': truncate(result.stderr)})
+
+    def case_finished(self, testcase, duration):
+        self.write({'type': 'case',
+                    'case': testcase.name,
+                    'passed': not testcase.failed,
+                    'duration': duration,
+                    'steps': len([step for step in testcase.steps
+                                  if step.executed]),
+                    'failures': testcase.failed,
+                    'fixture': testcase.broken})
+
+    def finish(self, duration):
+        self.write({'type': 'run', 'duration': duration})
+        self.file.close()
+
+
+class JUnitReporter(Reporter):
+    # Writes a JUnit XML report with one testsuite per test case. A suite is
+    # written as soon as its test case is finished, only the steps of the
+    # running test cases are kept in memory.
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.lock = threading.Lock()
+        self.pending = {}
+
+    def start(self):
+        self.file = open(self.path, 'w')
+        self.file.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                        '<testsuites>\n')
+        self.file.flush()
+
+    def case_started(self, testcase):
+        with self.lock:
+            self.pending[id(testcase)] = []
+
+    def step_finished(self, testcase, step, description, result):
+        element = ['    <testcase classname=%s name=%s time="%.3f">\n' %
+                   (quoteattr(testcase.name), quoteattr(description),
+                    result.duration / 1000.0)]
+        if not result.success:
+            message = 'timeout' if result.timed_out else \
+                      result.failure or 'step failed'
+            element.append('      <failure message=%s/>\n' %
+                           quoteattr(message))
+        if result.stdout:
+            element.append('      <system-out>%s</system-out>\n' %
+                           xml_text(result.stdout))
+        if result.stderr:
+            element.append('      <system-err>%s</system-err>\n' %
+                           xml_text(result.stderr))
+        element.append('    </testcase>\n')
+
+        with self.lock:
+            self.pending[id(testcase)].append((result, ''.join(element)))
+
+    def case_finished(self, testcase, duration):
+        with self.lock:
+            steps = self.pending.pop(id(testcase))
+            failures = len([result for result, _ in steps
+                            if not result.success])
+            if testcase.broken is not None:
+                # none of the steps ran
+                steps.append((None, '    <testcase classname=%s name=%s '
+                              'time="0.000">\n      <error message=%s/>\n'
+                              '    </testcase>\n' %
+                              (quoteattr(testcase.name),
+                               quoteattr('fixture'),
+                               quoteattr("fixture '%s' failed" %
+                                         testcase.broken))))
+                failures += 1
+            self.file.write('  <testsuite name=%s tests="%d" failures="%d" '
+                            'time="%.3f">\n' %
+                            (quoteattr(testcase.name), len(steps), failures,
+                             duration / 1000.0))
+            for _, element in steps:
+                self.file.write(element)
+            self.file.write('  </testsuite>\n')
+            self.file.flush()
+
+    def finish(self, duration):
+        with self.lock:
+            self.file.write('</testsuites>\n')
+            self.file.close()
@@ -0,0 +1,107 @@
+#
+# Copyright (C) 2015 BMW Car IT GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import json
+import os
+
+from pyrate.output.terminal import STATUS_SEP, STATUS_END, STATUS_FAILED, \
+    STATUS_PASSED
+
+
+class Summary:
+    # The statistics of a run. Summaries of several runs, e.g. the shards of
+    # a test suite, can be merged into one.
+
+    def __init__(self, cases=None, duration=0):
+        # one entry per executed test case
+        self.cases = cases if cases is not None else []
+        self.duration = duration
+
+    @classmethod
+    def of(cls, cases, duration):
+        entries = []
+        for case in cases:
+            if not case.executed:
+                continue
+            steps = [step for step in case.steps if step.executed]
+            # a case whose fixture failed or which failed without running
+            # a step, e.g. on a distributed worker, counts as one failed test
+            broken = 1 if case.broken is not None or \
+                (case.failed and not steps) else 0
+            entries.append({'name': case.name,
+                            'steps': len(steps) + broken,
+                            'failures': len([step for step in steps
+                                             if step.failed]) + broken,
+                            'duration': case.duration})
+        return cls(entries, duration)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r', encoding='utf-8') as stats:
+            record = json.load(stats)
+        return cls(record['cases'], record['duration'])
+
+    @classmethod
+    def merge(cls, summaries):
+        # shards run side by side, so the run took as long as the slowest
+        cases = []
+        for summary in summaries:
+            cases.extend(summary.cases)
+        return cls(cases, max([summary.duration for summary in summaries],
+                              default=0))
+
+    def save(self, path):
+        temporary = '%s.%d' % (path, os.getpid())
+        with open(temporary, 'w', encoding='utf-8') as stats:
+            json.dump({'cases': self.cases, 'duration': self.duration},
+                      stats, indent=1)
+        os.replace(temporary, path)
+
+    @property
+    def failed(self):
+        return [case for case in self.cases if case['failures']]
+
+    def report(self):
+        # prints the summary and returns False if any test case failed
+        steps_executed = sum(case['steps'] for case in self.cases)
+        steps_failed = sum(case['failures'] for case in self.cases)
+        cases_failed = self.failed
+
+        print(STATUS_SEP)
+        print("%s %d tests from %d test cases run. (%d ms total" % (
+            STATUS_END, steps_executed, len(self.cases), self.duration))
+
+        if len(cases_failed) > 0:
+            message_text_cases = "case"
+            if len(self.cases) > 1:
+                message_text_cases = "cases"
+            print("%s %d out of %d tests (%d of %d %s) failed" %
+                  (STATUS_FAILED, steps_failed, steps_executed,
+                   len(cases_failed), len(self.cases), message_text_cases))
+            print(STATUS_FAILED)
+
+            message_text_cases = "case"
+            if len(cases_failed) > 1:
+                message_text_cases = "cases"
+            print("%s %d failed %s, listed below:" %
+                  (STATUS_FAILED, len(cases_failed), message_text_cases))
+
+            for case in cases_failed:
+                print("%s %s" % (STATUS_FAILED, case['name']))
+            return False
+
+        print(STATUS_PASSED)
+        return True
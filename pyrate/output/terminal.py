@@ -16,15 +16,23 @@
 
 from termcolor import colored
 
+from pyrate.output.window import Window
+
 STATUS_SEP = colored('[----------]', 'green')
 STATUS_END = colored('[==========]', 'green')
 STATUS_RUN = colored('[  RUN     ]', 'green')
 STATUS_OK = colored('[      OK  ]', 'green')
+STATUS_CACHED = colored('[  CACHED  ]', 'green')
+STATUS_RETRY = colored('[  RETRY   ]', 'yellow')
+STATUS_STATS = colored('[  STATS   ]', 'cyan')
+STATUS_WATCH = colored('[  WATCH   ]', 'cyan')
+STATUS_SKIPPED = colored('[  SKIPPED ]', 'yellow')
 STATUS_PASSED = colored('[  PASSED  ]', 'green')
 STATUS_FAILED = colored('[  FAILED  ]', 'red')
+STATUS_PROFILE = colored('[  PROFILE ]', 'cyan')
 
 
-def print_expectation(type, expected, found, command=None):
+def print_expectation(type, expected, found, command=None, span=None):
 
     if command is not None:
         print(colored("\n\tCommand:", attrs=['bold']))
@@ -35,6 +43,11 @@ def print_expectation(type, expected, found, command=None):
         print(colored("\t%s" % line, 'green'))
 
     print(colored("\n\tGot:", attrs=['bold']))
-    for line in found.splitlines():
-        print(colored("\t%s" % line, 'red'))
+    for row in Window(found, span).rows():
+        if isinstance(row, str):
+            print(colored("\t%s" % row, attrs=['bold']))
+            continue
+        print("\t" + "".join(colored(text, 'red', attrs=['reverse'])
+                               if highlighted else colored(text, 'red')
+                               for text, highlighted in row))
     print()
@@ -0,0 +1,126 @@
+#
+# Copyright (C) 2015 BMW Car IT GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# bytes of a mapped stream which are counted at once
+BLOCK_SIZE = 1 << 20
+
+
+class Window:
+    # The lines of a stream shown in a failure report: the first and last
+    # 'lines' lines and the lines around a highlighted span, e.g. a match.
+    # Everything else is left out, so a huge stream doesn't flood the
+    # terminal. The stream is a str or a bytes-like object like an mmap,
+    # only the shown parts are decoded.
+
+    # lines from the start and the end of the stream, 0 shows everything
+    lines = 40
+    # lines before and after the highlighted span
+    context = 2
+
+    def __init__(self, stream, span=None):
+        self.stream = stream
+        self.span = span
+        self.newline = '\n' if type(stream) is str else b'\n'
+
+    def forward(self, position, count):
+        # end of the count-th line starting at position
+        for _ in range(count):
+            index = self.stream.find(self.newline, position)
+            if index < 0:
+                return len(self.stream)
+            position = index + 1
+        return position
+
+    def backward(self, position, count):
+        # start of the count-th line ending at position
+        if position > 0 and self.stream[position - 1:position] == \
+                self.newline:
+            position -= 1
+        for _ in range(count):
+            index = self.stream.rfind(self.newline, 0, position)
+            if index < 0:
+                return 0
+            position = index
+        return position + 1
+
+    def count(self, start, end):
+        # number of lines in between, an mmap can't count itself
+        if type(self.stream) in (str, bytes):
+            return self.stream.count(self.newline, start, end)
+        lines = 0
+        for position in range(start, end, BLOCK_SIZE):
+            block = self.stream[position:min(position + BLOCK_SIZE, end)]
+            lines += block.count(self.newline)
+        return lines
+
+    def regions(self):
+        size = len(self.stream)
+        if self.lines <= 0:
+            return [(0, size)]
+
+        regions = [(0, self.forward(0, self.lines)),
+                   (self.backward(size, self.lines), size)]
+        if self.span is not None:
+            line = self.stream.rfind(self.newline, 0, self.span[0]) + 1
+            regions.append((self.backward(line, self.context),
+                            self.forward(self.span[1], self.context + 1)))
+
+        merged = []
+        for start, end in sorted(regions):
+            if merged and start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(end, merged[-1][1]))
+            else:
+                merged.append((start, end))
+        return merged
+
+    def decode(self, start, end):
+        text = self.stream[start:end]
+        if type(text) is not str:
+            text = text.decode('utf-8', 'replace')
+        return text
+
+    def rows(self):
+        # Returns the rows to show, each a list of (text, highlighted)
+        # segments, or a str for a note about left out lines.
+        rows = []
+        previous = 0
+        for start, end in self.regions():
+            if start > previous:
+                rows.append("[... %d lines omitted ...]" %
+                            self.count(previous, start))
+
+            # split the region at the highlighted span
+            cuts = [start]
+            if self.span is not None:
+                cuts.extend(max(start, min(end, position))
+                            for position in self.span)
+            cuts.append(end)
+
+            row = []
+            for index in range(len(cuts) - 1):
+                highlighted = index == 1 and len(cuts) == 4
+                text = self.decode(cuts[index], cuts[index + 1])
+                lines = text.split('\n')
+                for number, line in enumerate(lines):
+                    if number > 0:
+                        rows.append(row)
+                        row = []
+                    if line:
+                        row.append((line, highlighted))
+            if row:
+                rows.append(row)
+            previous = end
+        return rows
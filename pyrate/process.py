@@ -0,0 +1,289 @@
+#
+# Copyright (C) 2015 BMW Car IT GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import heapq
+import os
+import signal
+import sys
+import threading
+import time
+
+import psutil
+
+# seconds between two samples of a monitored process tree
+SAMPLE_INTERVAL = 0.01
+
+
+def kill_process_tree(pid, sig=signal.SIGKILL):
+    try:
+        parent = psutil.Process(pid)
+    except psutil.Error:
+        return
+
+    # Children have to be collected before the parent gets killed, otherwise
+    # they are reparented and can't be found anymore. For a SIGKILL the
+    # tree is stopped top down while collecting it, so no process can fork
+    # a child which escapes.
+    processes = [parent]
+    pending = [parent]
+    while pending:
+        process = pending.pop()
+        try:
+            if sig == signal.SIGKILL:
+                process.suspend()
+            children = process.children()
+        except psutil.Error:
+            continue
+        processes.extend(children)
+        pending.extend(children)
+
+    for process in processes:
+        try:
+            os.kill(process.pid, sig)
+        except OSError:
+            pass
+
+
+def wait_exited(process):
+    # Waits until the process exited without reaping it. Its pid can't be
+    # reused until reap() is called, so it's safe to cancel timers which
+    # might still kill it in between.
+    if hasattr(os, 'waitid'):
+        try:
+            os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOWAIT)
+        except ChildProcessError:
+            pass
+
+
+def reap(process):
+    # Reaps the process and returns its exit code and the resource usage of
+    # the process and all of its children it waited for. ru_maxrss is
+    # normalized to KiB.
+    try:
+        _, status, rusage = os.wait4(process.pid, 0)
+    except ChildProcessError:
+        return process.wait(), None
+
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return process.returncode, rusage
+
+
+def max_rss(rusage):
+    if sys.platform == 'darwin':
+        return rusage.ru_maxrss // 1024
+    return rusage.ru_maxrss
+
+
+class TreeMonitor:
+    # Samples the process tree of a step while it runs: the peak memory of
+    # all processes together, the peak number of processes besides the
+    # shell running the command and the cpu time of every process seen.
+    # Processes living shorter than the sample interval can be missed, the
+    # rusage of a reaped shell is more exact for the cpu time. If root is
+    # False the process itself (a shell worker) isn't part of the tree.
+
+    def __init__(self, pid, root=True):
+        self.pid = pid
+        self.root = root
+        self.max_rss = 0
+        self.children = 0
+        self.cpu = {}
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        try:
+            self.process = psutil.Process(self.pid)
+        except psutil.Error:
+            return self
+        self.thread = threading.Thread(target=self.loop,
+                                       name='pyrate-monitor', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        if self.thread is not None:
+            self.stopped.set()
+            self.thread.join()
+            self.thread = None
+
+    def loop(self):
+        self.sample()
+        while not self.stopped.wait(SAMPLE_INTERVAL):
+            self.sample()
+
+    def sample(self):
+        try:
+            processes = self.process.children(recursive=True)
+        except psutil.Error:
+            return
+        if self.root:
+            processes.append(self.process)
+
+        rss = 0
+        count = 0
+        for process in processes:
+            try:
+                with process.oneshot():
+                    rss += process.memory_info().rss
+                    times = process.cpu_times()
+            except psutil.Error:
+                continue
+            count += 1
+            self.cpu[process.pid] = (times.user, times.system)
+
+        self.max_rss = max(self.max_rss, rss // 1024)
+        self.children = max(self.children, count - 1)
+
+    def record(self, result, rusage=None):
+        # adds the measurements to a StepResult, cpu times and max_rss in
+        # the rusage of the reaped shell take precedence
+        result.children = self.children
+        result.max_rss = max(result.max_rss, self.max_rss)
+        if rusage is None:
+            times = list(self.cpu.values())
+            result.cpu_user = sum(user for user, _ in times) * 1000
+            result.cpu_sys = sum(system for _, system in times) * 1000
+
+
+class CancelToken:
+    # Shared between a test case and the processes spawned for it. Cancelling
+    # the token kills every registered process tree, processes registered
+    # afterwards are killed right away.
+
+    def __init__(self):
+        self.cancelled = False
+        self.processes = set()
+        self.lock = threading.Lock()
+
+    def cancel(self):
+        with self.lock:
+            self.cancelled = True
+            processes = list(self.processes)
+
+        for process in processes:
+            kill_process_tree(process.pid)
+
+    def register(self, process):
+        with self.lock:
+            self.processes.add(process)
+            cancelled = self.cancelled
+
+        if cancelled:
+            kill_process_tree(process.pid)
+
+    def unregister(self, process):
+        with self.lock:
+            self.processes.discard(process)
+
+
+class Timeout:
+    # handle for a process registered at the TimeoutScheduler
+
+    def __init__(self, process, deadline, grace):
+        self.process = process
+        self.deadline = deadline
+        self.grace = grace
+        self.expired = False
+        self.cancelled = False
+        # whether the handle is in the heap of the scheduler
+        self.queued = True
+
+    def __lt__(self, other):
+        return self.deadline < other.deadline
+
+
+class TimeoutScheduler:
+    # One thread serves the timeouts of all running processes. It sleeps on
+    # a condition until the nearest deadline, so waiting doesn't cost any
+    # cpu time. On expiry the process tree gets a SIGTERM and, after the
+    # grace period, a SIGKILL. Without grace period it's killed right away.
+
+    def __init__(self):
+        self.heap = []
+        # cancelled handles which are still in the heap
+        self.cancelled = 0
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def schedule(self, process, timeout, grace=0):
+        # timeout and grace are given in milliseconds
+        handle = Timeout(process, time.monotonic() + timeout / 1000.0,
+                         grace / 1000.0)
+
+        with self.condition:
+            heapq.heappush(self.heap, handle)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.loop,
+                                               name='pyrate-timeouts',
+                                               daemon=True)
+                self.thread.start()
+            self.condition.notify()
+
+        return handle
+
+    def cancel(self, handle):
+        # After cancel() returns the process won't get any signal anymore.
+        # The handle stays in the heap until its deadline, so it lets go of
+        # the process, and the heap is rebuilt once cancelled handles make
+        # up more than half of it.
+        with self.condition:
+            if handle.cancelled:
+                return
+            handle.cancelled = True
+            handle.process = None
+            if not handle.queued:
+                return
+            self.cancelled += 1
+            if self.cancelled * 2 > len(self.heap):
+                self.heap = [entry for entry in self.heap
+                             if not entry.cancelled]
+                heapq.heapify(self.heap)
+                self.cancelled = 0
+
+    def loop(self):
+        with self.condition:
+            while True:
+                # drop cancelled handles lazily
+                while self.heap and self.heap[0].cancelled:
+                    heapq.heappop(self.heap).queued = False
+                    self.cancelled -= 1
+
+                if not self.heap:
+                    self.condition.wait()
+                    continue
+
+                remaining = self.heap[0].deadline - time.monotonic()
+                if remaining > 0:
+                    self.condition.wait(remaining)
+                    continue
+
+                handle = heapq.heappop(self.heap)
+                handle.queued = False
+                if not handle.expired and handle.grace > 0:
+                    handle.expired = True
+                    kill_process_tree(handle.process.pid, signal.SIGTERM)
+
+                    # come back for the SIGKILL after the grace period
+                    handle.deadline = time.monotonic() + handle.grace
+                    handle.queued = True
+                    heapq.heappush(self.heap, handle)
+                else:
+                    handle.expired = True
+                    kill_process_tree(handle.process.pid, signal.SIGKILL)
+
+
+timeouts = TimeoutScheduler()
@@ -0,0 +1,145 @@
+#
+# Copyright (C) 2015 BMW Car IT GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import glob
+import hashlib
+import json
+import os
+
+import pyrate
+from pyrate.util import resolveVariables
+
+# bytes of a file which are hashed at once
+BLOCK_SIZE = 1 << 20
+
+
+def file_digest(path, digest):
+    if os.path.isdir(path):
+        for directory, dirnames, filenames in sorted(os.walk(path)):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                file_digest(os.path.join(directory, filename), digest)
+        return
+
+    digest.update(path.encode('utf-8') + b'\0')
+    try:
+        with open(path, 'rb') as data:
+            block = data.read(BLOCK_SIZE)
+            while block:
+                digest.update(block)
+                block = data.read(BLOCK_SIZE)
+    except OSError:
+        digest.update(b'\0missing')
+    digest.update(b'\0')
+
+
+class ResultCache:
+    # Results of passed steps which declared to be cacheable, stored as one
+    # JSON file per key. The key is a hash of everything the result depends
+    # on: the resolved command and validators and the declared input files
+    # and environment variables. The least recently used results are
+    # evicted once the cache grows beyond max_size bytes.
+
+    def __init__(self):
+        self.directory = None
+        self.max_size = 256 * 1024 * 1024
+
+    @property
+    def enabled(self):
+        return self.directory is not None
+
+    def key(self, execution):
+        options = execution.step.cache
+        digest = hashlib.sha256(pyrate.__version__.encode('utf-8') + b'\0')
+        digest.update(execution.command.encode('utf-8') + b'\0')
+        for validator in execution.step.validators:
+            digest.update(validator.fingerprint(execution.variables)
+                          .encode('utf-8') + b'\0')
+
+        for pattern in options.inputs + execution.step.inputs:
+            pattern = resolveVariables(pattern, execution.variables)
+            paths = sorted(glob.glob(pattern)) or [pattern]
+            for path in paths:
+                file_digest(path, digest)
+
+        for name in options.env:
+            value = os.environ.get(name)
+            digest.update(('%s=%r\0' % (name, value)).encode('utf-8'))
+
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.json')
+
+    def load(self, key):
+        path = self.path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as entry:
+                record = json.load(entry)
+            # mark as recently used
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+
+        if record.get('key') != key:
+            return None
+        return record
+
+    def store(self, key, result):
+        path = self.path(key)
+        temporary = '%s.%d' % (path, os.getpid())
+        record = {'key': key,
+                  'exitcode': result.exitcode,
+                  'stdout': result.stdout,
+                  'stderr': result.stderr}
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(temporary, 'w', encoding='utf-8') as entry:
+                json.dump(record, entry)
+            os.replace(temporary, path)
+        except OSError:
+            # the cache is an optimization only
+            try:
+                os.unlink(temporary)
+            except OSError:
+                pass
+
+    def evict(self):
+        if not self.enabled:
+            return
+
+        entries = []
+        total = 0
+        for path in glob.glob(os.path.join(self.directory, '*', '*.json')):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            total -= size
+
+
+result_cache = ResultCache()
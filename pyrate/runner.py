@@ -0,0 +1,191 @@
+#
+# Copyright (C) 2015 BMW Car IT GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import asyncio
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from pyrate.async_engine import AsyncEngine, use_pidfd_watcher
+from pyrate.output.buffer import ThreadOutput
+from pyrate.output.reporter import reporters
+from pyrate.process import CancelToken
+
+ENGINE_THREAD = 'thread'
+ENGINE_ASYNCIO = 'asyncio'
+ENGINES = [ENGINE_THREAD, ENGINE_ASYNCIO]
+
+
+def run_cases(cases, variables, jobs=1, engine=ENGINE_THREAD):
+    if engine == ENGINE_ASYNCIO:
+        AsyncRunner(cases, variables, jobs).run()
+        return
+
+    if jobs > 1 and len(cases) > 1:
+        ParallelRunner(cases, variables, jobs).run()
+        return
+
+    for testcase in cases:
+        if not testcase.run(variables):
+            # break on fatal failure
+            break
+
+
+class ParallelRunner:
+    # Runs test cases on a pool of worker threads. The output of every case
+    # is buffered and printed in the order of the specification, so the log
+    # looks exactly like the one of a serial run.
+    #
+    # A fatal failure cancels all cases following the failed one. Cases
+    # which are queued don't start anymore, running cases get their
+    # processes killed and are reset to 'not executed' afterwards. Cases in
+    # front of the failed one are completed as they would be in a serial run.
+    # Reporters see a case when its output is printed, so they never see the
+    # cancelled ones.
+
+    def __init__(self, cases, variables, jobs):
+        self.cases = cases
+        self.variables = variables
+        self.jobs = jobs
+
+        self.tokens = [CancelToken() for _ in cases]
+        self.outputs = [None] * len(cases)
+        self.events = [None] * len(cases)
+        self.next_output = 0
+        self.fatal_index = len(cases)
+        self.lock = threading.Lock()
+        self.output = None
+
+    def run(self):
+        self.output = ThreadOutput(sys.stdout)
+        sys.stdout = self.output
+        try:
+            with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                futures = [executor.submit(self.run_case, index)
+                           for index in range(len(self.cases))]
+                try:
+                    for future in futures:
+                        future.result()
+                except BaseException:
+                    for future in futures:
+                        future.cancel()
+                    for token in self.tokens:
+                        token.cancel()
+                    raise
+        finally:
+            sys.stdout = self.output.stream
+
+        self.reset_cancelled()
+
+    def reset_cancelled(self):
+        # a serial run wouldn't have executed anything behind the fatal case
+        for testcase in self.cases[self.fatal_index + 1:]:
+            testcase.reset()
+
+    def run_case(self, index):
+        testcase = self.cases[index]
+        token = self.tokens[index]
+
+        text = ''
+        events = []
+        if not token.cancelled:
+            self.output.begin()
+            reporters.hold()
+            try:
+                success = testcase.run(self.variables, token)
+            finally:
+                text = self.output.end()
+                events = reporters.release()
+
+            if not success:
+                self.abort_after(index)
+
+        self.publish(index, text, events)
+
+    def abort_after(self, index):
+        with self.lock:
+            if index >= self.fatal_index:
+                return
+            self.fatal_index = index
+
+        for token in self.tokens[index + 1:]:
+            token.cancel()
+
+    def publish(self, index, text, events):
+        with self.lock:
+            self.outputs[index] = text
+            self.events[index] = events
+
+            # print everything which is complete in specification order
+            while (self.next_output < len(self.cases) and
+                   self.outputs[self.next_output] is not None):
+                if self.next_output <= self.fatal_index:
+                    self.output.emit(self.outputs[self.next_output])
+                    reporters.replay(self.events[self.next_output])
+                self.outputs[self.next_output] = ''
+                self.events[self.next_output] = None
+                self.next_output += 1
+
+
+class AsyncRunner(ParallelRunner):
+    # Runs all test cases as tasks of one asyncio event loop with the
+    # AsyncEngine. Here 'jobs' limits the number of processes running at
+    # the same time. Output and fatal failures are handled like in the
+    # ParallelRunner.
+
+    def run(self):
+        use_pidfd_watcher()
+
+        self.output = ThreadOutput(sys.stdout)
+        sys.stdout = self.output
+        try:
+            asyncio.run(self.run_all())
+        finally:
+            sys.stdout = self.output.stream
+
+        self.reset_cancelled()
+
+    async def run_all(self):
+        engine = AsyncEngine(self.jobs)
+        tasks = [asyncio.ensure_future(self.run_case_async(index, engine))
+                 for index in range(len(self.cases))]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for token in self.tokens:
+                token.cancel()
+            raise
+
+    async def run_case_async(self, index, engine):
+        testcase = self.cases[index]
+        token = self.tokens[index]
+
+        text = ''
+        events = []
+        if not token.cancelled:
+            self.output.begin()
+            reporters.hold()
+            try:
+                success = await testcase.run_async(self.variables, engine,
+                                                   token)
+            finally:
+                text = self.output.end()
+                events = reporters.release()
+
+            if not success:
+                self.abort_after(index)
+
+        self.publish(index, text, events)
@@ -0,0 +1,90 @@
+#
+# Copyright (C) 2015 BMW Car IT GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import fnmatch
+import heapq
+import re
+
+# prefix of a filter which is a regular expression instead of a glob
+REGEX_PREFIX = 're:'
+
+
+def compile_filter(pattern):
+    # globs have to match the whole name, regular expressions any part of it
+    if pattern.startswith(REGEX_PREFIX):
+        return re.compile(pattern[len(REGEX_PREFIX):]).search
+    return re.compile(fnmatch.translate(pattern)).match
+
+
+def select_cases(cases, patterns):
+    # a test case is selected if its name matches any of the patterns
+    filters = [compile_filter(pattern) for pattern in patterns]
+    return [case for case in cases
+            if any(matches(case.name) for matches in filters)]
+
+
+def parse_shard(text):
+    # 'i/N' with 1 <= i <= N
+    match = re.match(r'^(\d+)/(\d+)$', text)
+    if match is None:
+        raise ValueError("shard must be given as INDEX/COUNT")
+    index, count = int(match.group(1)), int(match.group(2))
+    if count < 1 or not 1 <= index <= count:
+        raise ValueError("shard %s out of range" % text)
+    return index, count
+
+
+def shard_cases(cases, index, count, durations):
+    # Splits the test cases into 'count' shards with about the same total
+    # duration and returns the cases of shard 'index' (1 based) in the
+    # order of the specification. The longest cases are placed first, each
+    # one on the shard with the least work so far. Cases without a known
+    # duration are assumed to take as long as the average known one. The
+    # split only depends on the cases and durations, so every node computes
+    # the same one.
+    known = [duration for duration in durations.values()
+             if duration is not None]
+    default = sum(known) / len(known) if known else 1
+
+    def cost(position):
+        duration = durations.get(cases[position].name)
+        return default if duration is None else duration
+
+    order = sorted(range(len(cases)),
+                   key=lambda position: (-cost(position),
+                                         cases[position].name, position))
+
+    loads = [(0, shard) for shard in range(count)]
+    assigned = [[] for _ in range(count)]
+    for position in order:
+        load, shard = heapq.heappop(loads)
+        assigned[shard].append(position)
+        heapq.heappush(loads, (load + cost(position), shard))
+
+    return [cases[position] for position in sorted(assigned[index - 1])]
+
+
+def group_by_fixtures(cases):
+    # Moves the test cases using the same session fixtures next to each
+    # other, so a fixture is set up for a short time only. The groups are
+    # in the order of their first case, the cases of a group keep their
+    # order.
+    groups = {}
+    for case in cases:
+        key = tuple(fixture.name for fixture in case.fixtures
+                    if fixture.session)
+        groups.setdefault(key, []).append(case)
+    return [case for group in groups.values() for case in group]
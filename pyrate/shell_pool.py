@@ -0,0 +1,264 @@
+#
+# Copyright (C) 2015 BMW Car IT GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import selectors
+import shlex
+import sys
+import threading
+import time
+import uuid
+from subprocess import Popen, PIPE
+
+import psutil
+
+from pyrate.capture import CHUNK_SIZE
+from pyrate.process import TreeMonitor, kill_process_tree, timeouts
+from pyrate.util import elapsed
+
+# On Linux the worker shell is started through this script, which makes the
+# process a child subreaper before it execs the shell. Processes a command
+# leaves behind are then reparented to the worker instead of init. Setting
+# it in a preexec_fn would run Python in the forked child of a multithreaded
+# process.
+SUBREAPER = '''
+import ctypes, os
+try:
+    ctypes.CDLL(None).prctl(36, 1, 0, 0, 0)
+except (OSError, AttributeError):
+    pass
+os.execv('/bin/sh', ['/bin/sh'])
+'''
+
+
+class Framer:
+    # Splits the output of a worker at the end marker of a command. Output
+    # before the marker goes to the sink, a few bytes are held back in case
+    # the marker is split over two chunks.
+
+    def __init__(self, marker, sink):
+        self.marker = marker
+        self.sink = sink
+        self.buffer = b''
+        self.trailer = None
+
+    def feed(self, data):
+        self.buffer += data
+        index = self.buffer.find(self.marker)
+        if index < 0:
+            keep = len(self.marker) - 1
+            if len(self.buffer) > keep:
+                self.sink.feed(self.buffer[:len(self.buffer) - keep])
+                self.buffer = self.buffer[len(self.buffer) - keep:]
+            return
+
+        if index > 0:
+            self.sink.feed(self.buffer[:index])
+        rest = self.buffer[index + len(self.marker):]
+        if b'\n' in rest:
+            self.trailer = rest[:rest.index(b'\n')]
+            self.buffer = b''
+        else:
+            self.buffer = self.buffer[index:]
+
+    def finish(self):
+        # the worker died, everything is command output
+        if self.buffer:
+            self.sink.feed(self.buffer)
+            self.buffer = b''
+        self.sink.close()
+
+
+class ShellWorker:
+    # A long-lived /bin/sh which runs commands sent through its stdin. Every
+    # command runs in a subshell (fork, but no exec and no shell startup),
+    # so it can't change the state of the worker. After the command the
+    # worker prints a marker with a random nonce and the exit status to
+    # stdout and the marker to stderr.
+
+    def __init__(self):
+        self.marker = ('__PYRATE_%s__' % uuid.uuid4().hex).encode('ascii')
+        command = ['/bin/sh']
+        if sys.platform.startswith('linux'):
+            command = [sys.executable, '-S', '-c', SUBREAPER]
+        self.process = Popen(command, stdin=PIPE, stdout=PIPE, stderr=PIPE)
+        self.pid = self.process.pid
+        self.alive = True
+
+    def script(self, command):
+        marker = self.marker.decode('ascii')
+        return ("( eval %s ) </dev/null\n"
+                "printf '%%s%%d\\n' '%s' \"$?\"\n"
+                "printf '%%s\\n' '%s' >&2\n" % (shlex.quote(command),
+                                                 marker, marker))
+
+    def send(self, command):
+        # returns False if the worker died while it was idle
+        try:
+            self.process.stdin.write(self.script(command).encode('utf-8'))
+            self.process.stdin.flush()
+        except OSError:
+            self.shutdown()
+            self.process.wait()
+            return False
+        return True
+
+    def run(self, stdout, stderr, abort=None):
+        # Returns the exit code and whether the command was aborted. If the
+        # worker died (e.g. it was killed on timeout) the exit code is the
+        # one of the worker, like for a fresh shell.
+        framers = [Framer(self.marker, stdout), Framer(self.marker, stderr)]
+        selector = selectors.DefaultSelector()
+        selector.register(self.process.stdout, selectors.EVENT_READ,
+                          framers[0])
+        selector.register(self.process.stderr, selectors.EVENT_READ,
+                          framers[1])
+
+        aborted = False
+        while self.alive and (framers[0].trailer is None or
+                              framers[1].trailer is None):
+            for key, _ in selector.select():
+                framer = key.data
+                if framer.trailer is not None:
+                    continue
+                data = os.read(key.fd, CHUNK_SIZE)
+                if not data:
+                    self.alive = False
+                    break
+                framer.feed(data)
+
+            if abort is not None and not aborted and abort():
+                aborted = True
+                kill_process_tree(self.pid)
+        selector.close()
+
+        if not self.alive:
+            for framer in framers:
+                framer.finish()
+            self.shutdown()
+            return self.process.wait(), aborted
+
+        for framer in framers:
+            framer.sink.close()
+        return int(framers[0].trailer), aborted
+
+    def left_behind(self):
+        # processes started by the last command which are still running,
+        # without a subreaper only the ones which weren't orphaned yet
+        path = '/proc/%d/task/%d/children' % (self.pid, self.pid)
+        try:
+            with open(path) as children:
+                return bool(children.read().strip())
+        except OSError:
+            pass
+        try:
+            return bool(psutil.Process(self.pid).children())
+        except psutil.Error:
+            return False
+
+    def shutdown(self):
+        # Retire the worker without killing anything a command left behind,
+        # the shell exits at the end of its input.
+        self.alive = False
+        for stream in (self.process.stdin, self.process.stdout,
+                       self.process.stderr):
+            try:
+                stream.close()
+            except OSError:
+                pass
+
+
+class ShellPool:
+    # Pool of shell workers for steps with 'shell: persistent'. A worker is
+    # retired after a timeout, an abort or when its command left processes
+    # behind; a new one is started on demand.
+
+    def __init__(self, size=1):
+        self.size = size
+        # whether steps without a 'shell' key use the pool
+        self.default = False
+        self.idle = []
+        self.count = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while not self.idle and self.count >= self.size:
+                self.condition.wait()
+            if self.idle:
+                return self.idle.pop()
+            self.count += 1
+
+        try:
+            return ShellWorker()
+        except OSError:
+            self.release(None)
+            raise
+
+    def release(self, worker):
+        with self.condition:
+            if worker is not None and worker.alive:
+                self.idle.append(worker)
+            else:
+                self.count -= 1
+            self.condition.notify()
+
+    def run(self, step, execution, cancel, result):
+        start = time.perf_counter()
+        while True:
+            worker = self.acquire()
+            if worker.send(execution.command):
+                break
+            self.release(worker)
+        result.spawn = elapsed(start)
+
+        if cancel is not None:
+            cancel.register(worker)
+
+        timeout = None
+        if step.timeout > 0:
+            timeout = timeouts.schedule(worker, step.timeout, step.grace)
+
+        # the worker itself isn't part of the process tree of the command
+        monitor = None
+        if step.monitored:
+            monitor = TreeMonitor(worker.pid, root=False).start()
+
+        try:
+            result.exitcode, result.aborted = worker.run(
+                execution.sinks['stdout'],
+                execution.sinks['stderr'], execution.abort)
+
+            if timeout is not None:
+                timeouts.cancel(timeout)
+                result.timed_out = timeout.expired
+            if cancel is not None:
+                cancel.unregister(worker)
+
+            if worker.alive and (result.timed_out or worker.left_behind()):
+                worker.shutdown()
+        finally:
+            if monitor is not None:
+                monitor.stop()
+            self.release(worker)
+
+        result.wall = elapsed(start)
+        if monitor is not None:
+            monitor.record(result)
+        return result
+
+
+shell_pool = ShellPool()
@@ -0,0 +1,78 @@
+#
+# Copyright (C) 2015 BMW Car IT GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import hashlib
+import json
+import os
+
+
+class State:
+    # Data about the test cases which is kept from one run to the next: the
+    # duration and result of the last run of every case and the digest of
+    # its definition at that time. A missing or damaged file is an empty
+    # state.
+
+    def __init__(self, path, variables=None):
+        self.path = path
+        self.cases = {}
+
+        # the global variables are part of the definition of every case
+        self.variables = hashlib.sha256(json.dumps(
+            variables or {}, sort_keys=True, default=str).encode('utf-8'))
+
+        try:
+            with open(path, 'r', encoding='utf-8') as state:
+                cases = json.load(state).get('cases', {})
+            if type(cases) is dict:
+                self.cases = cases
+        except (OSError, ValueError, AttributeError):
+            pass
+
+    def duration(self, name):
+        return self.cases.get(name, {}).get('duration')
+
+    def digest(self, case):
+        digest = self.variables.copy()
+        digest.update(case.digest.encode('ascii'))
+        return digest.hexdigest()
+
+    def failed(self, case):
+        # cases which never ran haven't failed
+        return self.cases.get(case.name, {}).get('passed') is False
+
+    def changed(self, case):
+        return self.cases.get(case.name, {}).get('digest') != \
+            self.digest(case)
+
+    def record(self, cases):
+        for case in cases:
+            if case.executed:
+                self.cases[case.name] = {'duration': case.duration,
+                                         'passed': not case.failed,
+                                         'digest': self.digest(case)}
+
+    def save(self):
+        temporary = '%s.%d' % (self.path, os.getpid())
+        try:
+            with open(temporary, 'w', encoding='utf-8') as state:
+                json.dump({'cases': self.cases}, state, indent=1,
+                          sort_keys=True)
+            os.replace(temporary, self.path)
+        except OSError:
+            try:
+                os.unlink(temporary)
+            except OSError:
+                pass
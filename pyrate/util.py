@@ -15,6 +15,9 @@
 #
 
 import datetime
+import functools
+import time
+from string import Formatter
 
 
 def duration(start):
@@ -22,21 +25,192 @@ def duration(start):
     return diff.total_seconds() * 1000
 
 
-def resolveVariables(string, vars, depth = 0):
-    new = string.format_map(DefaultVariableDict(**vars))
+def elapsed(start):
+    # milliseconds since a time.perf_counter() timestamp
+    return (time.perf_counter() - start) * 1000
 
-    # recursively resolve variables if the string has been changed
-    if string == new:
-        # nothing changed
-        return new
 
-    # limit the depth to 10 in order to inhibit an infinite recursion
-    if depth < 10:
-        return resolveVariables(new, vars, depth + 1)
+def resolveVariables(string, vars):
+    if not isinstance(vars, VariableScope):
+        vars = VariableScope(vars)
+    return vars.resolve(string)
 
-    return new
 
+class VariableCycleException(Exception):
+    def __init__(self, names):
+        self.names = names
+        self.message = "cyclic variable reference: %s" % " -> ".join(names)
 
-class DefaultVariableDict(dict):
-    def __missing__(self, key):
-        return '{%s}' % key
+    def __str__(self):
+        return repr(self.message)
+
+
+FORMATTER = Formatter()
+
+
+@functools.lru_cache(maxsize=16384)
+def parse_template(string):
+    # Splits a string into a tuple of literal strings and fields. A field is
+    # a tuple of (variable, original text, field name, conversion, spec).
+    tokens = []
+    try:
+        parsed = list(FORMATTER.parse(string))
+    except ValueError:
+        # unbalanced braces, e.g. in a regular expression
+        return (string,)
+
+    for literal, field, spec, conversion in parsed:
+        if literal:
+            tokens.append(literal)
+        if field is None:
+            continue
+
+        original = '{%s%s%s}' % (field,
+                                 '!' + conversion if conversion else '',
+                                 ':' + spec if spec else '')
+        variable = field.split('.', 1)[0].split('[', 1)[0]
+        if not variable.isidentifier():
+            # positional fields and regex quantifiers like '{2,3}' are no
+            # variables, keep them as they are
+            tokens.append(original)
+        else:
+            tokens.append((variable, original, field, conversion, spec))
+
+    return tuple(tokens)
+
+
+def has_variables(string):
+    return any(type(token) is tuple for token in parse_template(string))
+
+
+def escape_variables(string):
+    # the string stays as it is when it gets resolved
+    return string.replace('{', '{{').replace('}', '}}')
+
+
+class VariableScope:
+    # Resolves strings against a set of variables. The values of variables
+    # may refer to other variables, each value is resolved once per scope
+    # and cached. References to unknown variables are kept as they are.
+    #
+    # A child scope overrides some variables of its parent (e.g. the
+    # arguments of a step). It reuses the values resolved by the parent as
+    # long as they don't depend on an overridden variable.
+
+    def __init__(self, variables, parent=None):
+        self.variables = variables
+        self.parent = parent
+        self.resolved = {}
+        self.dependencies = {}
+
+    def child(self, variables):
+        if not variables:
+            return self
+        return VariableScope(variables, self)
+
+    def lookup(self, name):
+        if name in self.variables:
+            return self.variables[name]
+        if self.parent is not None:
+            return self.parent.lookup(name)
+        return None
+
+    def resolve(self, string):
+        return self.substitute(string, True)[0]
+
+    def known(self, name):
+        # Returns True and the resolved value of a variable with the set of
+        # variables it depends on (or None if the variable is unknown) if
+        # that needs no resolving in this scope. Otherwise returns False and
+        # the raw value.
+        if name in self.resolved:
+            return True, (self.resolved[name], self.dependencies[name])
+
+        if name not in self.variables and self.parent is not None:
+            result = self.parent.value(name)
+            if result is None or not (result[1] & self.variables.keys()):
+                return True, result
+
+        raw = self.lookup(name)
+        if raw is None:
+            return True, None
+        return False, raw
+
+    def value(self, name):
+        # returns the resolved value of a variable and the set of variables
+        # it depends on, or None if the variable is unknown
+        if name in self.resolved:
+            return self.resolved[name], self.dependencies[name]
+        done, raw = self.known(name)
+        if done:
+            return raw
+
+        resolved, dependencies, missing = self.substitute(raw)
+        if missing is None:
+            dependencies = dependencies | {name}
+            self.resolved[name] = resolved
+            self.dependencies[name] = dependencies
+            return resolved, dependencies
+
+        # The variables a value refers to are resolved before it, depth
+        # first with an explicit stack, so long chains of references don't
+        # exhaust the Python stack.
+        stack = [(name, raw)]
+        pending = {name}
+        while stack:
+            current, raw = stack[-1]
+            resolved, dependencies, missing = self.substitute(raw)
+            if missing is None:
+                self.resolved[current] = resolved
+                self.dependencies[current] = dependencies | {current}
+                pending.discard(current)
+                stack.pop()
+            elif missing[0] in pending:
+                names = [entry[0] for entry in stack]
+                raise VariableCycleException(
+                    names[names.index(missing[0]):] + [missing[0]])
+            else:
+                pending.add(missing[0])
+                stack.append(missing)
+
+        return self.resolved[name], self.dependencies[name]
+
+    def substitute(self, string, resolving=False):
+        # Returns the string with the variables substituted and the set of
+        # variables it depends on. If a variable has to be resolved first,
+        # its name and raw value are returned as the third element instead,
+        # unless resolving is set.
+        parts = []
+        dependencies = frozenset()
+        for token in parse_template(string):
+            if type(token) is str:
+                parts.append(token)
+                continue
+
+            variable, original, field, conversion, spec = token
+            done, result = self.known(variable)
+            if not done:
+                if not resolving:
+                    return None, None, (variable, result)
+                result = self.value(variable)
+            if result is None:
+                # a child scope might define it
+                dependencies = dependencies | {variable}
+                parts.append(original)
+                continue
+
+            value, used = result
+            dependencies = dependencies | used
+            if field != variable or conversion or spec:
+                value = FORMATTER.get_field(field, (), {variable: value})[0]
+                value = FORMATTER.format_field(
+                    FORMATTER.convert_field(value, conversion or None),
+                    spec or '')
+            parts.append(value)
+
+        return ''.join(parts), dependencies, None
+
+    def check(self):
+        # raises a VariableCycleException for cyclic references
+        for name in self.variables:
+            self.value(name)
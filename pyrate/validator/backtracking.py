@@ -0,0 +1,192 @@
+#
+# Copyright (C) 2015 BMW Car IT GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+import functools
+import string
+
+try:
+    from re import _constants as sre_constants, _parser as sre_parse
+except ImportError:
+    import sre_constants
+    import sre_parse
+
+# Characters are tracked as sets of ASCII characters, everything else is
+# represented by OTHER.
+OTHER = None
+ALL = frozenset(chr(code) for code in range(128)) | {OTHER}
+WORD = frozenset(string.ascii_letters + string.digits + '_') | {OTHER}
+CATEGORIES = {
+    'CATEGORY_DIGIT': frozenset(string.digits),
+    'CATEGORY_SPACE': frozenset(string.whitespace),
+    'CATEGORY_WORD': WORD,
+}
+
+REPEATS = (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT)
+EMPTY = frozenset()
+
+
+def category(name):
+    name = str(name)
+    if name.startswith('CATEGORY_NOT_'):
+        return ALL - CATEGORIES.get('CATEGORY_' + name[13:], EMPTY)
+    return CATEGORIES.get(name, ALL)
+
+
+def literal(code):
+    char = chr(code)
+    if code >= 128:
+        return {OTHER}
+    # case insensitive patterns may match either case
+    return {char, char.lower(), char.upper()}
+
+
+def class_set(items):
+    chars = set()
+    negate = False
+    for op, av in items:
+        if op == sre_constants.NEGATE:
+            negate = True
+        elif op == sre_constants.LITERAL:
+            chars |= literal(av)
+        elif op == sre_constants.RANGE:
+            low, high = av
+            if high >= 128:
+                chars.add(OTHER)
+            for code in range(low, min(high, 127) + 1):
+                chars |= literal(code)
+        elif op == sre_constants.CATEGORY:
+            chars |= category(av)
+        else:
+            return ALL
+    return ALL - chars if negate else frozenset(chars)
+
+
+def first(items):
+    # the characters a sequence may start with and whether it may match
+    # the empty string
+    chars = set()
+    for op, av in items:
+        item, nullable = first_item(op, av)
+        chars |= item
+        if not nullable:
+            return chars, False
+    return chars, True
+
+
+def first_item(op, av):
+    if op == sre_constants.LITERAL:
+        return literal(av), False
+    if op == sre_constants.NOT_LITERAL:
+        return ALL - {chr(av)}, False
+    if op == sre_constants.ANY:
+        return ALL, False
+    if op == sre_constants.IN:
+        return class_set(av), False
+    if op == sre_constants.BRANCH:
+        chars = set()
+        nullable = False
+        for branch in av[1]:
+            item, empty = first(branch)
+            chars |= item
+            nullable = nullable or empty
+        return chars, nullable
+    if op == sre_constants.SUBPATTERN:
+        return first(av[-1])
+    if op in REPEATS or op == getattr(sre_constants, 'POSSESSIVE_REPEAT',
+                                      None):
+        low, high, body = av
+        if high == 0:
+            return EMPTY, True
+        chars, nullable = first(body)
+        return chars, nullable or low == 0
+    if op == getattr(sre_constants, 'ATOMIC_GROUP', None):
+        return first(av)
+    if op in (sre_constants.AT, sre_constants.ASSERT,
+              sre_constants.ASSERT_NOT):
+        return EMPTY, True
+    # back references and conditionals could be anything
+    return ALL, True
+
+
+def walk(items, follow):
+    # Returns why the sequence may backtrack catastrophically or None.
+    # follow is None outside of an unbounded repetition, otherwise the
+    # characters which may come after the sequence before the repetition
+    # is left, including the start of its next iteration.
+    for index, (op, av) in enumerate(items):
+        inner = None
+        if follow is not None:
+            rest, nullable = first(items[index + 1:])
+            inner = rest | follow if nullable else rest
+
+        if op in REPEATS:
+            low, high, body = av
+            chars, _ = first(body)
+            if inner is not None and low != high and chars & inner:
+                # the characters matched by this quantifier may as well be
+                # matched by what comes after it in the outer repetition,
+                # so there are exponentially many ways to split the input
+                return "nested quantifiers which match the same characters"
+            if high == sre_constants.MAXREPEAT:
+                reason = walk(body, chars | (inner or EMPTY))
+            else:
+                reason = walk(body, inner)
+        elif op == sre_constants.BRANCH:
+            branches = [first(branch) for branch in av[1]]
+            if inner is not None:
+                for number, (chars, nullable) in enumerate(branches):
+                    if any(chars & other
+                           for other, _ in branches[number + 1:]):
+                        return "alternatives in a repetition which start " \
+                               "with the same characters"
+                    # an empty alternative competes with what comes after
+                    if nullable and any(other & inner
+                                        for other, _ in branches):
+                        return "alternatives in a repetition which start " \
+                               "with the same characters"
+            reason = None
+            for branch in av[1]:
+                reason = reason or walk(branch, inner)
+        elif op == sre_constants.SUBPATTERN:
+            reason = walk(av[-1], inner)
+        elif op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+            reason = walk(av[1], None)
+        elif op == sre_constants.GROUPREF_EXISTS:
+            reason = walk(av[1], inner) or (av[2] is not None and
+                                            walk(av[2], inner)) or None
+        else:
+            # possessive quantifiers and atomic groups don't backtrack
+            reason = None
+
+        if reason is not None:
+            return reason
+    return None
+
+
+@functools.lru_cache(maxsize=4096)
+def risk(pattern, flags=0):
+    # Returns why the pattern is likely to backtrack catastrophically on
+    # some input or None. It's a heuristic: it looks for quantifiers nested
+    # in unbounded repetitions and for overlapping alternatives in them,
+    # where the same input can be matched in exponentially many ways.
+    if type(pattern) is bytes:
+        pattern = pattern.decode('utf-8', 'replace')
+    try:
+        parsed = sre_parse.parse(pattern, flags)
+    except Exception:
+        return None
+    return walk(list(parsed), None)
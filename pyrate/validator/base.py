@@ -19,6 +19,16 @@ import sys
 
 class BaseValidator:
 
-    def validate(self, exitcode, stdout, stderr, variables, command):
+    def validate(self, exitcode, stdout, stderr, variables, command,
+                 metadata=None):
+        # metadata is the StepResult of the execution with its measurements
         print("Base method not implemented", file=sys.stderr)
         return False
+
+    def fingerprint(self, variables):
+        # identifies the resolved validator for the result cache
+        return self.__class__.__name__
+
+    def failure(self, result):
+        # a short reason for reports, after the validator failed on result
+        return "%s failed" % self.__class__.__name__
@@ -40,7 +40,15 @@ class ExitCodeValidator(BaseValidator):
                 # TODO has to be parsed
                 self.code = 234234
 
-    def validate(self, exitcode, stdout, stderr, variables, command):
+    def fingerprint(self, variables):
+        return "exit %s%d" % ('!' if self.negate else '', self.code)
+
+    def failure(self, result):
+        return "exit status %s, expected %s%d" % (
+            result.exitcode, 'not ' if self.negate else '', self.code)
+
+    def validate(self, exitcode, stdout, stderr, variables, command,
+                 metadata=None):
         valid = exitcode == self.code
         if self.negate:
             valid = not valid
@@ -48,6 +56,7 @@ class ExitCodeValidator(BaseValidator):
         if not valid:
             prefix = 'not ' if self.negate else ''
             expectation = "%s%s" % (prefix, self.code)
-            print_expectation("exit status", expectation, "%d" % exitcode, command)
+            print_expectation("exit status", expectation, "%d" % exitcode,
+                              command)
 
         return valid
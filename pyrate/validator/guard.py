@@ -0,0 +1,151 @@
+#
+# Copyright (C) 2015 BMW Car IT GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+import multiprocessing
+import re
+import threading
+
+
+class RegexTimeout(Exception):
+    def __init__(self, pattern, text, budget):
+        self.pattern = pattern
+        self.size = len(text)
+        self.budget = budget
+        unit = 'characters' if type(text) is str else 'bytes'
+        self.message = "search in %d %s took longer than %d ms" % (
+            self.size, unit, budget)
+
+    def __str__(self):
+        return self.message
+
+
+def serve(connection):
+    # the worker process, searches until the connection is closed
+    while True:
+        try:
+            pattern, flags, text, position = connection.recv()
+        except EOFError:
+            return
+        match = re.compile(pattern, flags).search(text, position)
+        connection.send(match.span() if match is not None else None)
+
+
+class SearchWorker:
+    # a process searching on behalf of the guard
+
+    def __init__(self, context):
+        self.connection, child = context.Pipe()
+        self.process = context.Process(target=serve, args=(child,),
+                                       name='pyrate-regex', daemon=True)
+        self.process.start()
+        child.close()
+
+    def search(self, regex, text, position, timeout):
+        # returns the span of the match or None, raises RegexTimeout if
+        # the search doesn't finish within timeout milliseconds
+        self.connection.send((regex.pattern, regex.flags, text, position))
+        if not self.connection.poll(timeout / 1000.0):
+            self.kill()
+            raise RegexTimeout(regex.pattern, text, timeout)
+        return self.connection.recv()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.connection.close()
+
+
+class RegexGuard:
+    # Searches with patterns which are likely to backtrack catastrophically
+    # (see backtracking.risk()) run in worker processes, which are killed if
+    # a search takes longer than the budget. Python's re engine can't be
+    # interrupted, so the search can't run in the test process itself.
+    # Idle workers are kept for the next search; the first one takes a
+    # moment to start.
+
+    def __init__(self):
+        # milliseconds per search, 0 searches in the test process
+        self.timeout = 10000
+        self.idle = []
+        self.lock = threading.Lock()
+        self.context = None
+
+    def acquire(self):
+        with self.lock:
+            if self.idle:
+                return self.idle.pop()
+            if self.context is None:
+                # a forked worker could inherit locks held by other threads
+                self.context = multiprocessing.get_context('spawn')
+        return SearchWorker(self.context)
+
+    def search(self, regex, text, position=0):
+        # returns the span of the first match or None
+        if self.timeout <= 0:
+            match = regex.search(text, position)
+            return match.span() if match is not None else None
+
+        if type(text) not in (str, bytes):
+            # e.g. an mmap of spilled output
+            text = text[:]
+
+        worker = self.acquire()
+        try:
+            span = worker.search(regex, text, position, self.timeout)
+        except (EOFError, OSError):
+            # the worker died, e.g. it ran out of memory
+            worker.kill()
+            match = regex.search(text, position)
+            return match.span() if match is not None else None
+        with self.lock:
+            self.idle.append(worker)
+        return span
+
+
+regex_guard = RegexGuard()
+
+
+class Found:
+    # the part of a match which is available from a worker
+
+    def __init__(self, span):
+        self.position = span
+
+    def span(self):
+        return self.position
+
+    def start(self):
+        return self.position[0]
+
+    def end(self):
+        return self.position[1]
+
+
+class GuardedRegex:
+    # A compiled regex whose searches go through the guard. It only
+    # supports search(), it is never combined with other patterns.
+
+    guarded = True
+
+    def __init__(self, regex):
+        self.regex = regex
+        self.pattern = regex.pattern
+        self.flags = regex.flags
+
+    def search(self, text, position=0):
+        span = regex_guard.search(self.regex, text, position)
+        return Found(span) if span is not None else None
@@ -0,0 +1,249 @@
+#
+# Copyright (C) 2015 BMW Car IT GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import functools
+import re
+
+try:
+    from re import _constants as sre_constants, _parser as sre_parse
+except ImportError:
+    import sre_constants
+    import sre_parse
+
+from pyrate.validator.guard import Found, RegexTimeout
+
+# Patterns which can't be embedded into an alternation because they refer to
+# groups by number or name or set global flags. They are searched on their own.
+STANDALONE = re.compile(r'\\[1-9]|\(\?P[<=]|\(\?\(|^\(\?[aiLmsux]+\)')
+
+METACHARACTERS = set('.^$*+?{}[]\\|()')
+QUANTIFIERS = set('*+?{')
+
+# Patterns starting with a literal prefix of this length are searched on their
+# own. The re module scans for such a prefix in C, which is faster than any
+# alternation.
+PREFIX_LENGTH = 3
+
+# Patterns which can't be searched as bytes are searched in windows of this
+# many bytes of the decoded output. Consecutive windows overlap, a match
+# longer than the overlap can be missed if it spans two windows.
+WINDOW_SIZE = 4 * 1024 * 1024
+WINDOW_OVERLAP = 64 * 1024
+
+
+# Resolved patterns are compiled through this cache. It is much larger than
+# the internal cache of the re module, which gets thrashed by suites with many
+# distinct patterns.
+@functools.lru_cache(maxsize=4096)
+def compile_pattern(pattern, flags=0):
+    return re.compile(pattern, flags)
+
+
+def source(pattern):
+    # bytes patterns are used for output which is read from a file, they
+    # are analyzed like the str pattern they were encoded from
+    if type(pattern) is bytes:
+        return pattern.decode('utf-8', 'replace')
+    return pattern
+
+
+def byte_items(items):
+    for op, av in items:
+        if op == sre_constants.LITERAL:
+            if av >= 128:
+                return False
+        elif op == sre_constants.SUBPATTERN:
+            if av[1] & re.IGNORECASE or not byte_items(av[3]):
+                return False
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+            if not byte_items(av[2]):
+                return False
+        elif op == sre_constants.BRANCH:
+            if not all(byte_items(branch) for branch in av[1]):
+                return False
+        elif op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+            if not byte_items(av[1]):
+                return False
+        elif op == sre_constants.AT:
+            # word boundaries depend on what a word character is
+            if av in (sre_constants.AT_BOUNDARY,
+                      sre_constants.AT_NON_BOUNDARY):
+                return False
+        elif op != sre_constants.GROUPREF:
+            # '.', classes and categories match characters, not bytes
+            return False
+    return True
+
+
+@functools.lru_cache(maxsize=4096)
+def byte_safe(pattern, flags=0):
+    # Whether the pattern encoded as UTF-8 finds a match in the encoded
+    # text exactly if the pattern finds one in the text. That's the case
+    # for ASCII literals, groups, repetitions and anchors without case
+    # folding, anything matching a character might match part of one.
+    try:
+        parsed = sre_parse.parse(pattern, flags)
+    except Exception:
+        return False
+    if parsed.state.flags & re.IGNORECASE:
+        return False
+    return byte_items(list(parsed))
+
+
+def char_start(data, index):
+    # moves index back to the first byte of a UTF-8 encoded character
+    while 0 < index < len(data) and data[index] & 0xC0 == 0x80:
+        index -= 1
+    return index
+
+
+class WindowedRegex:
+    # A str regex searched in bytes-like output, e.g. a spilled stream, one
+    # window at a time so the output is never decoded as a whole. Every
+    # window but the first starts with the character in front of it, the
+    # search starts behind that character so '^' and '\A' only match at the
+    # start of the output. A match ending at the last character of a window
+    # may be due to '$' or '\Z', it's left to the next window. Spans are
+    # byte offsets. Like a guarded regex it is never combined with others.
+
+    guarded = True
+
+    def __init__(self, regex):
+        self.regex = regex
+        self.pattern = regex.pattern
+        self.flags = regex.flags
+
+    def search(self, data, position=0):
+        size = len(data)
+        start = char_start(data, position)
+        while True:
+            end = size
+            if start + WINDOW_SIZE < size:
+                end = char_start(data, start + WINDOW_SIZE)
+            context = char_start(data, start - 1) if start > 0 else 0
+            window = data[context:end].decode('utf-8', 'replace')
+            index = 1 if context < start else 0
+            while True:
+                match = self.regex.search(window, index)
+                if match is None:
+                    break
+                if end == size or match.end() < len(window) - 1:
+                    begin = context + len(
+                        window[:match.start()].encode('utf-8'))
+                    return Found((begin, begin + len(
+                        match.group().encode('utf-8'))))
+                index = match.start() + 1
+            if end == size:
+                return None
+            start = char_start(data, max(end - WINDOW_OVERLAP, start + 1))
+
+
+def is_literal(pattern):
+    return not METACHARACTERS.intersection(pattern)
+
+
+def literal_prefix(pattern):
+    for end, char in enumerate(pattern):
+        if char in METACHARACTERS:
+            if char in QUANTIFIERS or (char == '|' and end > 0):
+                # the last character is optional or an alternative
+                return pattern[:max(end - 1, 0)] if char != '|' else ''
+            return pattern[:end]
+    return pattern
+
+
+def search_all(regexes, text, indexes=None, errors=None):
+    # Searches all given regexes (or the ones selected by indexes) in text
+    # and returns the set of indexes which matched, with the same result as
+    # calling regex.search(text) for each of them. text is a str or, with
+    # bytes regexes, any bytes-like object like an mmap. Guarded regexes
+    # which run out of time are recorded in the errors list if given.
+    #
+    # Literal patterns use a plain substring search, patterns with a literal
+    # prefix a search of their own. All others are combined
+    # into one alternation which finds the leftmost position where any of
+    # them matches. The patterns matching at that position are looked up,
+    # removed from the alternation and the search continues behind it. This
+    # way the text is scanned once no matter how many patterns there are.
+    # The alternation is non-capturing, capturing groups would disable the
+    # prefix optimizations of the re module.
+    if indexes is None:
+        indexes = range(len(regexes))
+
+    found = set()
+    combined = []
+    flags = None
+    for index in indexes:
+        regex = regexes[index]
+        if regex is None:
+            continue
+
+        pattern = source(regex.pattern)
+        if getattr(regex, 'guarded', False):
+            try:
+                if regex.search(text):
+                    found.add(index)
+            except RegexTimeout as e:
+                if errors is None:
+                    raise
+                errors[index] = e
+        elif is_literal(pattern):
+            if text.find(regex.pattern) >= 0:
+                found.add(index)
+        elif (STANDALONE.search(pattern) or
+              len(literal_prefix(pattern)) >= PREFIX_LENGTH or
+              (flags is not None and regex.flags != flags)):
+            if regex.search(text):
+                found.add(index)
+        else:
+            flags = regex.flags
+            combined.append(index)
+
+    position = 0
+    while combined:
+        if len(combined) == 1:
+            if regexes[combined[0]].search(text, position):
+                found.add(combined[0])
+            break
+
+        alternation = '|'.join('(?:%s)' % source(regexes[index].pattern)
+                               for index in combined)
+        if type(regexes[combined[0]].pattern) is bytes:
+            alternation = alternation.encode('utf-8')
+        try:
+            regex = compile_pattern(alternation, flags)
+        except (re.error, RecursionError):
+            # e.g. too deeply nested, fall back to single searches
+            for index in combined:
+                if regexes[index].search(text, position):
+                    found.add(index)
+            break
+
+        match = regex.search(text, position)
+        if match is None:
+            break
+
+        position = match.start()
+        remaining = []
+        for index in combined:
+            if regexes[index].match(text, position):
+                found.add(index)
+            else:
+                remaining.append(index)
+        combined = remaining
+        position += 1
+
+    return found
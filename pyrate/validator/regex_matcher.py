@@ -15,10 +15,21 @@
 #
 
 import re
+import sys
 
 from pyrate.exception import ParseException
 from pyrate.output.terminal import print_expectation
-from pyrate.util import resolveVariables
+from pyrate.util import has_variables, resolveVariables
+from pyrate.validator.backtracking import risk
+from pyrate.validator.guard import GuardedRegex, RegexTimeout, regex_guard
+from pyrate.validator.multi_search import byte_safe, compile_pattern
+from pyrate.validator.multi_search import WindowedRegex, literal_prefix
+
+# shortest part of a pattern which is shown as the nearest match
+NEAREST_LENGTH = 3
+
+# patterns which were reported as likely to backtrack catastrophically
+WARNED = set()
 
 
 class RegexMatcher:
@@ -45,23 +56,122 @@ class RegexMatcher:
         else:
             raise ParseException("stream validator must be string or list")
 
+        if type(self.pattern) is not str:
+            raise ParseException("pattern must be a string (is '%s')" %
+                                 type(self.pattern))
+
+        # Patterns without variables don't need to be resolved on every run,
+        # they are compiled right away so errors show up at parse time.
+        self.static = None
+        self.regex = None
+        if not has_variables(self.pattern):
+            self.static = resolveVariables(self.pattern, {})
+            try:
+                self.regex = compile_pattern(self.static)
+            except re.error as e:
+                raise ParseException("invalid regular expression '%s': %s" %
+                                     (self.pattern, e))
+            reason = risk(self.static)
+            if reason is not None and self.static not in WARNED:
+                WARNED.add(self.static)
+                print("Warning: pattern '%s' may backtrack catastrophically "
+                      "(%s), it is searched with a time limit" %
+                      (self.pattern, reason), file=sys.stderr)
+
+    def resolve(self, variables, flags=0, binary=False):
+        # returns the resolved pattern and its compiled regex. If binary is
+        # set it's a bytes regex, unless matching bytes could give another
+        # result than matching the decoded text, then the regex searches
+        # decoded windows of the bytes. Patterns likely to
+        # backtrack catastrophically are searched through the regex guard.
+        if self.static is not None:
+            pattern = self.static
+            if flags == 0 and not binary:
+                return pattern, self.guarded(self.regex)
+        else:
+            pattern = resolveVariables(self.pattern, variables)
+
+        if not binary:
+            return pattern, self.guarded(compile_pattern(pattern, flags))
+        if byte_safe(pattern, flags):
+            return pattern, self.guarded(
+                compile_pattern(pattern.encode('utf-8'), flags))
+        return pattern, WindowedRegex(
+            self.guarded(compile_pattern(pattern, flags)))
+
+    def guarded(self, regex):
+        if regex_guard.timeout > 0 and risk(regex.pattern, regex.flags):
+            return GuardedRegex(regex)
+        return regex
+
+    def fingerprint(self, variables):
+        pattern = self.static
+        if pattern is None:
+            pattern = resolveVariables(self.pattern, variables)
+        return ('!' if self.negate else '') + pattern
+
     def validate(self, stream, type, variables, command):
 
-        pattern = resolveVariables(self.pattern, variables)
+        try:
+            pattern, regex = self.resolve(variables)
+        except re.error as e:
+            return self.invalid(e, stream, type, variables, command)
+
+        try:
+            result = regex.search(stream)
+        except RegexTimeout as e:
+            return self.invalid(e, stream, type, variables, command)
 
-        result = re.search(pattern, stream)
+        return self.check(pattern, result is not None, stream, type, command,
+                          regex)
 
+    def invalid(self, error, stream, type, variables, command):
+        if isinstance(error, RegexTimeout):
+            condition = 'does not contain' if self.negate else 'contains'
+            print_expectation("%s %s, %s" % (type, condition, error),
+                              resolveVariables(self.pattern, variables),
+                              stream, command)
+            return False
+
+        # a pattern which became invalid by resolving its variables
+        print_expectation("%s matches valid regular expression (%s)" %
+                          (type, error),
+                          resolveVariables(self.pattern, variables),
+                          stream, command)
+        return False
+
+    def check(self, pattern, found, stream, type, command, regex=None):
         if self.negate:
             # must not match
-            if result is not None:
+            if found:
                 # found a match
+                span = None
+                if regex is not None:
+                    try:
+                        match = regex.search(stream)
+                    except RegexTimeout:
+                        match = None
+                    span = match.span() if match else None
                 print_expectation("%s does not contain" %
-                                  type, pattern, stream, command)
+                                  type, pattern, stream, command, span)
                 return False
         else:
-            if result is None:
+            if not found:
                 # found no match but expected one
-                print_expectation("%s contains" % type, pattern, stream, command)
+                print_expectation("%s contains" % type, pattern, stream,
+                                  command, self.nearest(pattern, stream))
                 return False
 
         return True
+
+    def nearest(self, pattern, stream):
+        # the span of the longest start of the pattern's literal prefix which
+        # occurs in the stream
+        prefix = literal_prefix(pattern)
+        if type(stream) is not str:
+            prefix = prefix.encode('utf-8')
+        for length in range(len(prefix), NEAREST_LENGTH - 1, -1):
+            index = stream.find(prefix[:length])
+            if index >= 0:
+                return index, index + length
+        return None
@@ -0,0 +1,100 @@
+#
+# Copyright (C) 2015 BMW Car IT GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+import re
+
+from pyrate.exception import ParseException
+from pyrate.output.terminal import print_expectation
+from pyrate.validator.base import BaseValidator
+
+# memory limits may carry a unit, plain numbers are KiB
+SIZE = re.compile(r'^\s*(\d+)\s*([KMG]?)i?B?\s*$', re.IGNORECASE)
+UNITS = {'': 1, 'K': 1, 'M': 1024, 'G': 1024 * 1024}
+
+
+def parse_size(key, value):
+    if type(value) is int:
+        return value
+    if type(value) is str:
+        match = SIZE.match(value)
+        if match:
+            return int(match.group(1)) * UNITS[match.group(2).upper()]
+    raise ParseException("%s must be an integer (KiB) or a size like "
+                         "'64M' (is '%s')" % (key, value))
+
+
+class ResourceValidator(BaseValidator):
+    # An upper limit for a measurement of the process tree of a step. The
+    # measurements come with the metadata of the execution, for repeated
+    # steps (see RepeatOptions) they are the statistic over all runs.
+
+    KEY_DURATION = 'max_duration'
+    KEY_CPU_TIME = 'max_cpu_time'
+    KEY_RSS = 'max_rss'
+    KEY_CHILDREN = 'max_children'
+    KEYS = (KEY_DURATION, KEY_CPU_TIME, KEY_RSS, KEY_CHILDREN)
+
+    UNIT = {KEY_DURATION: 'ms', KEY_CPU_TIME: 'ms', KEY_RSS: 'KiB',
+            KEY_CHILDREN: 'processes'}
+
+    def __init__(self, key, yaml_tree):
+        self.key = key
+        # set by the step if it's repeated
+        self.repeat = None
+        if key == self.KEY_RSS:
+            self.limit = parse_size(key, yaml_tree)
+        elif type(yaml_tree) is int:
+            self.limit = yaml_tree
+        else:
+            raise ParseException("%s must be an integer (is '%s')" %
+                                 (key, type(yaml_tree)))
+        if self.limit < 0:
+            raise ParseException("%s must not be negative" % key)
+
+    def measure(self, metadata):
+        if self.key == self.KEY_DURATION:
+            return metadata.wall
+        if self.key == self.KEY_CPU_TIME:
+            return metadata.cpu_user + metadata.cpu_sys
+        if self.key == self.KEY_RSS:
+            return metadata.max_rss
+        return metadata.children
+
+    def fingerprint(self, variables):
+        return "%s %d" % (self.key, self.limit)
+
+    def failure(self, result):
+        return "%s: %d %s, limit %d" % (self.key, self.measure(result),
+                                         self.UNIT[self.key], self.limit)
+
+    def validate(self, exitcode, stdout, stderr, variables, command,
+                 metadata=None):
+        if metadata is None:
+            return True
+
+        value = self.measure(metadata)
+        if value <= self.limit:
+            return True
+
+        unit = self.UNIT[self.key]
+        found = "%d %s" % (value, unit)
+        if self.repeat is not None and self.repeat.count > 1:
+            found += " (%s of %d runs)" % (self.repeat.statistic,
+                                           self.repeat.count)
+        print_expectation(self.key, "at most %d %s" % (self.limit, unit),
+                          found, command)
+        return False
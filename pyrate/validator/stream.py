@@ -14,8 +14,12 @@
 # limitations under the License.
 #
 
+import re
+
 from pyrate.exception import ParseException
+from pyrate.model.streaming import StreamingOptions
 from pyrate.validator.base import BaseValidator
+from pyrate.validator.multi_search import search_all
 from pyrate.validator.regex_matcher import RegexMatcher
 
 
@@ -32,7 +36,8 @@ class StreamValidator(BaseValidator):
         else:
             raise ParseException("%s must be string or list" % stream)
 
-    def validate(self, exitcode, stdout, stderr, variables, command):
+    def validate(self, exitcode, stdout, stderr, variables, command,
+                 metadata=None):
         stream = ''
         if self.stream == 'stdout':
             stream = stdout
@@ -41,9 +46,110 @@ class StreamValidator(BaseValidator):
         else:
             raise Exception("Invalid stream: %s" % self.stream)
 
+        # all patterns are searched in a single pass over the stream, a
+        # stream which was spilled to a file is searched as bytes by the
+        # patterns which give the same result on bytes
+        state = StreamState(self, variables,
+                            StreamingOptions.ANCHORS_OUTPUT,
+                            type(stream) is not str)
+        state.feed(stream)
+        state.finish()
+        return state.report(stream, command)
+
+    def failure(self, result):
+        return "%s does not match the expected patterns" % self.stream
+
+    def fingerprint(self, variables):
+        return "%s %s" % (self.stream, repr([matcher.fingerprint(variables)
+                                             for matcher in self.validators]))
+
+    def start(self, variables, anchors):
+        return StreamState(self, variables, anchors)
+
+
+class StreamState:
+    # Incremental validation of a stream for streaming steps. The stream is
+    # fed in blocks of complete lines, every pattern is searched until it
+    # matched once.
+
+    def __init__(self, validator, variables, anchors, binary=False):
+        self.validator = validator
+
+        self.whole = None
+        flags = re.MULTILINE
+        if anchors == StreamingOptions.ANCHORS_OUTPUT:
+            # collect everything and search once the stream is complete
+            self.whole = []
+            flags = 0
+
+        self.variables = variables
+        self.patterns = []
+        self.regexes = []
+        self.errors = []
+        for matcher in validator.validators:
+            try:
+                pattern, regex = matcher.resolve(variables, flags, binary)
+                error = None
+            except re.error as e:
+                pattern, regex, error = None, None, e
+            self.patterns.append(pattern)
+            self.regexes.append(regex)
+            self.errors.append(error)
+        self.found = [False] * len(self.patterns)
+
+    def feed(self, block):
+        if self.whole is not None:
+            self.whole.append(block)
+            return
+
+        pending = [index for index, found in enumerate(self.found)
+                   if not found and self.errors[index] is None]
+        for index in search_all(self.regexes, block, pending, self.errors):
+            self.found[index] = True
+
+    def finish(self):
+        if self.whole is not None:
+            stream = self.whole[0] if len(self.whole) == 1 else \
+                ''.join(self.whole)
+            self.whole = None
+            pending = [index for index, error in enumerate(self.errors)
+                       if error is None]
+            found = search_all(self.regexes, stream, pending, self.errors)
+            self.found = [index in found
+                          for index in range(len(self.regexes))]
+
+    def decided(self):
+        # returns the validation result as soon as it can't change anymore,
+        # None otherwise
+        negated = False
+        pending = False
+        if any(self.errors):
+            return False
+
+        for matcher, found in zip(self.validator.validators, self.found):
+            if matcher.negate:
+                if found:
+                    return False
+                negated = True
+            elif not found:
+                pending = True
+
+        if pending or negated:
+            return None
+        return True
+
+    def report(self, stream, command):
         validation_result = True
-        for validator in self.validators:
-            result = validator.validate(stream, self.stream, variables, command)
+        for matcher, pattern, regex, found, error in zip(
+                self.validator.validators, self.patterns, self.regexes,
+                self.found, self.errors):
+            if error is not None:
+                result = matcher.invalid(error, stream,
+                                         self.validator.stream,
+                                         self.variables, command)
+            else:
+                result = matcher.check(pattern, found, stream,
+                                       self.validator.stream, command, regex)
 
             # if result is failed, set command to None so it doesn't get
             # printed out multiple times.
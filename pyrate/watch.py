@@ -0,0 +1,161 @@
+#
+# Copyright (C) 2015 BMW Car IT GmbH
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import ctypes
+import ctypes.util
+import fnmatch
+import glob
+import os
+import select
+import struct
+import time
+
+# inotify(7)
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+# writes are reported once the file is closed, metadata changes (e.g. the
+# access time updated by reading a file) are no changes
+IN_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+           IN_DELETE)
+EVENT = struct.Struct('iIII')
+
+# seconds between two scans when polling
+POLL_INTERVAL = 0.5
+# changes arriving within this many seconds are handled together
+SETTLE_TIME = 0.2
+
+
+def watched_directory(pattern):
+    # the directory to watch for files matching a path or glob pattern
+    pattern = os.path.abspath(pattern)
+    if os.path.isdir(pattern) and not glob.has_magic(pattern):
+        return pattern
+    directory = os.path.dirname(pattern)
+    while glob.has_magic(directory):
+        directory = os.path.dirname(directory)
+    return directory
+
+
+def affected_cases(cases, variables, changed):
+    # the cases with an input matching any of the changed paths
+    affected = []
+    for case in cases:
+        for pattern in case.inputs(variables):
+            pattern = os.path.abspath(pattern)
+            if any(path == pattern or fnmatch.fnmatchcase(path, pattern) or
+                   path.startswith(pattern + os.sep) for path in changed):
+                affected.append(case)
+                break
+    return affected
+
+
+class Watcher:
+    # Reports changes of files in a set of directories, through inotify on
+    # Linux and by polling the modification times elsewhere. Directories
+    # are watched instead of files, so files replaced by editors and files
+    # created later are noticed too.
+
+    def __init__(self):
+        self.directories = {}
+        self.fd = None
+        self.libc = None
+        self.snapshot = {}
+
+        try:
+            self.libc = ctypes.CDLL(ctypes.util.find_library('c'),
+                                    use_errno=True)
+            self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            self.fd = None
+        if self.fd is not None and self.fd < 0:
+            self.fd = None
+
+    def watch(self, directories):
+        for directory in set(directories):
+            if directory in self.directories.values() or \
+                    not os.path.isdir(directory):
+                continue
+            if self.fd is not None:
+                wd = self.libc.inotify_add_watch(
+                    self.fd, os.fsencode(directory), IN_MASK)
+                if wd >= 0:
+                    self.directories[wd] = directory
+            else:
+                self.directories[directory] = directory
+        if self.fd is None:
+            self.snapshot = self.scan()
+
+    def scan(self):
+        files = {}
+        for directory in self.directories.values():
+            try:
+                names = os.listdir(directory)
+            except OSError:
+                continue
+            for name in names:
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files[path] = (stat.st_mtime_ns, stat.st_size)
+        return files
+
+    def wait(self):
+        # blocks until something changed and returns the changed paths
+        changed = self.changes(None)
+        while True:
+            more = self.changes(SETTLE_TIME)
+            if not more:
+                return changed
+            changed |= more
+
+    def changes(self, timeout):
+        if self.fd is None:
+            return self.poll(timeout)
+
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+
+        data = os.read(self.fd, 65536)
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            wd, _, _, length = EVENT.unpack_from(data, offset)
+            offset += EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if wd in self.directories:
+                changed.add(os.path.join(self.directories[wd],
+                                         os.fsdecode(name)))
+        return changed
+
+    def poll(self, timeout):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            time.sleep(POLL_INTERVAL if timeout is None
+                       else min(POLL_INTERVAL, timeout))
+            files = self.scan()
+            changed = set(path for path in set(files) | set(self.snapshot)
+                          if files.get(path) != self.snapshot.get(path))
+            self.snapshot = files
+            if changed or (deadline is not None and
+                           time.monotonic() >= deadline):
+                return changed